@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Control de admisión y backpressure para /process.
+
+Cada petición reserva una estimación de la memoria que va a usar (a partir de
+Content-Length y, si ya se leyó el label, de ROWS). Mientras la suma de las
+reservas supere el presupuesto global, las nuevas peticiones esperan en cola
+hasta ADMISSION_QUEUE_TIMEOUT segundos; si no hay hueco se rechazan con
+429 + Retry-After. La cola se atiende en orden de llegada: sólo la primera
+petición en cola puede entrar, y las nuevas no se adelantan mientras haya
+alguna esperando, así que una ráfaga de subidas pequeñas no deja sin turno a
+una grande. Una petición que no cabe en el presupuesto se admite igual si el
+servidor está vacío (no hay otra forma de procesarla). Además se limita
+el número de peticiones simultáneas por cliente, contando las que esperan en
+cola.
+
+El cliente es la IP de la conexión. X-Forwarded-For sólo se tiene en cuenta si
+la conexión viene de un proxy de ADMISSION_TRUSTED_PROXIES; si no, cualquiera
+podría saltarse el límite por cliente enviando esa cabecera.
+
+Variables de entorno:
+    ADMISSION_MAX_INFLIGHT_MB:   presupuesto global en MB (default: 1024)
+    ADMISSION_MAX_PER_CLIENT:    peticiones simultáneas por cliente (default: 2)
+    ADMISSION_QUEUE_TIMEOUT:     segundos máximos de espera en cola (default: 15)
+    ADMISSION_MAX_QUEUE:         peticiones máximas esperando en cola (default: 16)
+    ADMISSION_RETRY_AFTER:       valor de Retry-After en segundos (default: 10)
+    ADMISSION_BYTES_FACTOR:      memoria estimada por byte subido (default: 6)
+    ADMISSION_BYTES_PER_ROW:     memoria estimada por fila (ROWS) (default: 400)
+    ADMISSION_TRUSTED_PROXIES:   IPs de proxies de confianza separadas por comas (default: ninguna)
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+from env_config import env_float
+
+
+class AdmissionRejected(Exception):
+    """Petición rechazada por el control de admisión."""
+
+    def __init__(self, message, status_code=429, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Reserva de memoria de una petición admitida."""
+
+    def __init__(self, client_id, cost):
+        self.client_id = client_id
+        self.cost = int(cost)
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Presupuesto global de bytes en vuelo + límite de concurrencia por cliente.
+    Pensado para un único event loop (un proceso uvicorn).
+    """
+
+    def __init__(self, max_inflight_bytes, max_per_client=2, queue_timeout=15.0,
+                 max_queue=16, retry_after=10, bytes_factor=6.0, bytes_per_row=400):
+        self.max_inflight_bytes = int(max_inflight_bytes)
+        self.max_per_client = int(max_per_client)
+        self.queue_timeout = float(queue_timeout)
+        self.max_queue = int(max_queue)
+        self.retry_after = int(retry_after)
+        self.bytes_factor = float(bytes_factor)
+        self.bytes_per_row = float(bytes_per_row)
+
+        self.inflight_bytes = 0
+        self.inflight_requests = 0
+        self._waiters = deque()
+        self._per_client = {}
+        self._cond = asyncio.Condition()
+
+        self.stats = {
+            "admitted": 0,
+            "admitted_after_wait": 0,
+            "rejected_budget": 0,
+            "rejected_client": 0,
+            "rejected_queue_full": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "peak_inflight_bytes": 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_inflight_bytes=env_float("ADMISSION_MAX_INFLIGHT_MB", 1024) * 1024 * 1024,
+            max_per_client=env_float("ADMISSION_MAX_PER_CLIENT", 2),
+            queue_timeout=env_float("ADMISSION_QUEUE_TIMEOUT", 15),
+            max_queue=env_float("ADMISSION_MAX_QUEUE", 16),
+            retry_after=env_float("ADMISSION_RETRY_AFTER", 10),
+            bytes_factor=env_float("ADMISSION_BYTES_FACTOR", 6),
+            bytes_per_row=env_float("ADMISSION_BYTES_PER_ROW", 400),
+        )
+
+    # -------------------------
+    # Estimación de coste
+    # -------------------------
+    def estimate_cost(self, content_length=None, rows=None):
+        """
+        Estima la memoria pico de procesar una subida.
+        El archivo se mantiene en memoria como bytes, se decodifica a texto y se
+        divide en líneas, así que el pico es varias veces el tamaño subido.
+        """
+        cost = 0
+        if content_length:
+            cost = max(cost, int(content_length * self.bytes_factor))
+        if rows:
+            cost = max(cost, int(rows * self.bytes_per_row))
+        # Mínimo razonable para subidas muy pequeñas
+        return max(cost, 1024 * 1024)
+
+    # -------------------------
+    # Admisión
+    # -------------------------
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _fits(self, cost):
+        # Sin nada en vuelo se admite aunque supere el presupuesto (como try_grow)
+        return self.inflight_requests == 0 or self.inflight_bytes + cost <= self.max_inflight_bytes
+
+    def _drop_client(self, client_id):
+        n = self._per_client.get(client_id, 1) - 1
+        if n > 0:
+            self._per_client[client_id] = n
+        else:
+            self._per_client.pop(client_id, None)
+
+    def _take(self, ticket):
+        self.inflight_bytes += ticket.cost
+        self.inflight_requests += 1
+        self.stats["admitted"] += 1
+        self.stats["peak_inflight_bytes"] = max(self.stats["peak_inflight_bytes"], self.inflight_bytes)
+
+    async def acquire(self, client_id, cost):
+        """
+        Reserva `cost` bytes para `client_id`. Espera en cola (FIFO) si no hay
+        presupuesto o si ya hay peticiones esperando; lanza AdmissionRejected
+        si no se puede admitir. Las peticiones en cola cuentan para el límite
+        por cliente.
+        """
+        if self._per_client.get(client_id, 0) >= self.max_per_client:
+            self.stats["rejected_client"] += 1
+            raise AdmissionRejected(
+                f"Demasiadas peticiones simultáneas (máximo {self.max_per_client} por cliente)",
+                retry_after=self.retry_after
+            )
+
+        ticket = AdmissionTicket(client_id, cost)
+        self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+        admitted = False
+        try:
+            async with self._cond:
+                if not self._waiters and self._fits(cost):
+                    self._take(ticket)
+                    admitted = True
+                    return ticket
+
+                if self.queued >= self.max_queue:
+                    self.stats["rejected_queue_full"] += 1
+                    raise AdmissionRejected(
+                        "Servidor ocupado, intenta de nuevo más tarde",
+                        retry_after=self.retry_after
+                    )
+
+                self._waiters.append(ticket)
+                t0 = time.monotonic()
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._waiters[0] is ticket and self._fits(cost)),
+                        self.queue_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.stats["rejected_budget"] += 1
+                    raise AdmissionRejected(
+                        "Servidor ocupado, intenta de nuevo más tarde",
+                        retry_after=self.retry_after
+                    )
+                finally:
+                    self._waiters.remove(ticket)
+                    # El siguiente de la cola pasa a ser el primero: puede que ya quepa
+                    self._cond.notify_all()
+                    waited = time.monotonic() - t0
+                    self.stats["wait_seconds_total"] += waited
+                    self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], waited)
+
+                self._take(ticket)
+                admitted = True
+                self.stats["admitted_after_wait"] += 1
+                return ticket
+        finally:
+            if not admitted:
+                self._drop_client(client_id)
+
+    def try_grow(self, ticket, new_cost):
+        """
+        Amplía la reserva de un ticket ya admitido (p. ej. al conocer ROWS).
+        No espera: retorna False si el nuevo coste no cabe en el presupuesto.
+        """
+        extra = int(new_cost) - ticket.cost
+        if extra <= 0:
+            return True
+        if self.inflight_bytes + extra > self.max_inflight_bytes and self.inflight_requests > 1:
+            self.stats["rejected_budget"] += 1
+            return False
+        self.inflight_bytes += extra
+        ticket.cost += extra
+        self.stats["peak_inflight_bytes"] = max(self.stats["peak_inflight_bytes"], self.inflight_bytes)
+        return True
+
+    async def release(self, ticket):
+        if ticket is None or ticket.released:
+            return
+        ticket.released = True
+        async with self._cond:
+            self.inflight_bytes -= ticket.cost
+            self.inflight_requests -= 1
+            self._drop_client(ticket.client_id)
+            self._cond.notify_all()
+
+    def metrics(self):
+        return {
+            "inflight_bytes": self.inflight_bytes,
+            "inflight_requests": self.inflight_requests,
+            "queued": self.queued,
+            "active_clients": len(self._per_client),
+            "max_inflight_bytes": self.max_inflight_bytes,
+            "max_per_client": self.max_per_client,
+            "queue_timeout": self.queue_timeout,
+            **self.stats,
+        }
+
+
+TRUSTED_PROXIES = frozenset(
+    ip.strip() for ip in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",") if ip.strip()
+)
+
+
+def client_id_from_request(request, trusted_proxies=None):
+    """
+    Identifica al cliente por la IP de la conexión. Si la conexión viene de un
+    proxy de confianza, usa la última IP de X-Forwarded-For que no sea un proxy
+    de confianza (las anteriores las escribe el propio cliente).
+    """
+    trusted = TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    host = request.client.host if request.client else "unknown"
+    fwd = request.headers.get("x-forwarded-for")
+    if not fwd or host not in trusted:
+        return host
+    for ip in reversed([ip.strip() for ip in fwd.split(",") if ip.strip()]):
+        if ip not in trusted:
+            return ip
+    return host
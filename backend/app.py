@@ -1,15 +1,23 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse
 from typing import Optional
-import pandas as pd
-import numpy as np
 import openai
 import io
 import os
 import json
 from dotenv import load_dotenv
-from rosetta_pipeline import process_tab_file
+from rosetta_pipeline import (
+    read_tab_xy, read_tab_xy_lines, resolve_precision, summarize_spectrum,
+    tab_compression_from_filename, open_tab_text_stream, read_label_header_from_lines,
+    FILTER_LEVELS, uses_high_thresholds, resolve_detector
+)
+from spectrum_cache import CachedSpectrum, spectrum_cache_from_env
+from species_matching import format_candidates
+from admission import AdmissionController, AdmissionRejected, client_id_from_request
+from parallel_parse import PARSE_WORKERS
+from calibration import CALIBRATION_DEFAULT, calibrate_xy
+from profiling import SamplingProfiler, is_admin_token, profile_path, profiling_enabled, profiling_requested, PROFILE_FORMATS
 
 # Cargar variables de entorno
 load_dotenv()
@@ -18,6 +26,73 @@ load_dotenv('config.env')
 
 app = FastAPI(title="Rosetta Spectrum Analyzer")
 
+# Espectros parseados para /refilter (límites configurables por variables de entorno)
+spectrum_cache = spectrum_cache_from_env()
+
+# Control de admisión para /process (límites configurables por variables de entorno)
+admission = AdmissionController.from_env()
+
+
+def _admission_error_response(e):
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"error": str(e)},
+        headers=headers
+    )
+
+
+# Se registra antes que CORS para que las respuestas 429 también lleven cabeceras CORS
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    if request.method != "POST" or request.url.path != "/process":
+        return await call_next(request)
+
+    # Sin Content-Length (subida chunked) no se puede estimar la memoria antes
+    # de leer el cuerpo: se rechaza en vez de admitirla con el coste mínimo
+    try:
+        content_length = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        return _admission_error_response(AdmissionRejected(
+            "Se requiere la cabecera Content-Length", status_code=411
+        ))
+
+    client_id = client_id_from_request(request)
+    try:
+        ticket = await admission.acquire(client_id, admission.estimate_cost(content_length=content_length))
+    except AdmissionRejected as e:
+        print(f"[WARNING] Petición rechazada ({client_id}, {content_length} bytes): {e}")
+        return _admission_error_response(e)
+
+    request.state.admission_ticket = ticket
+    try:
+        return await call_next(request)
+    finally:
+        await admission.release(ticket)
+
+
+# Perfilado por muestreo (sólo si PROFILING_TOKEN está configurado; si no, no se registra)
+if profiling_enabled():
+    @app.middleware("http")
+    async def profiling_middleware(request: Request, call_next):
+        # La descarga de perfiles lleva el mismo token pero no se perfila
+        if request.url.path.startswith("/profiles/") or not profiling_requested(request):
+            return await call_next(request)
+
+        profiler = SamplingProfiler().start()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.stop()
+
+        profile_id = profiler.save(f"{request.method} {request.url.path}")
+        print(f"[PROFILE] {request.method} {request.url.path}: {profiler.duration * 1000:.0f} ms, "
+              f"{profiler.samples} muestras, id {profile_id}")
+        for name, seconds in profiler.hotspots():
+            print(f"[PROFILE]   {seconds * 1000:8.1f} ms  {name}")
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -48,167 +123,295 @@ async def root():
     }
 
 
+@app.get("/metrics/admission")
+async def admission_metrics():
+    return admission.metrics()
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: str, format: str = "speedscope"):
+    """
+    Descarga un perfil guardado por el perfilado por muestreo (sólo administradores,
+    con la cabecera X-Profile).
+    
+    Args:
+        profile_id: Valor de la cabecera X-Profile-Id de la respuesta perfilada
+        format: "speedscope" (JSON para speedscope.app) o "collapsed" (pilas colapsadas)
+    """
+    if not is_admin_token(request.headers.get("x-profile")):
+        return JSONResponse(status_code=404, content={"error": "Perfil no encontrado"})
+    path = profile_path(profile_id, format)
+    if path is None or not path.exists():
+        return JSONResponse(status_code=404, content={"error": "Perfil no encontrado"})
+    return FileResponse(path, media_type=PROFILE_FORMATS[format][1], filename=path.name)
+
+
+def _parse_flag(value, default=False):
+    """Interpreta un campo booleano del formulario ("true"/"1"/"on"); vacío usa el default."""
+    if value is None or not str(value).strip() or value == "None":
+        return default
+    return str(value).strip().lower() in ("1", "true", "on", "yes")
+
+
+def _build_filter_params(detector, filter_level, head_drop=None, mad_multiplier_rtof=None,
+                         cps_threshold_rtof=None, mad_multiplier_dfms=None, cps_threshold_dfms=None):
+    """
+    Convierte los campos del formulario en filter_params, usando los defaults
+    del detector y nivel de filtrado cuando faltan o no son válidos.
+    """
+    # Preparar parámetros de filtrado (aplican tanto para alto como bajo grado)
+    filter_params = {}
+    high = uses_high_thresholds(filter_level)
+
+    # Head drop
+    try:
+        if head_drop and head_drop != "None" and str(head_drop).strip():
+            filter_params["head_drop"] = int(head_drop)
+        else:
+            filter_params["head_drop"] = 10 if detector == "RTOF" else 5
+        print(f"[INFO] Head drop: {filter_params['head_drop']}")
+    except (ValueError, TypeError) as e:
+        filter_params["head_drop"] = 10 if detector == "RTOF" else 5
+        print(f"[WARNING] Error parseando head_drop: {e}, usando default: {filter_params['head_drop']}")
+
+    # MAD multiplier RTOF
+    try:
+        if mad_multiplier_rtof and mad_multiplier_rtof != "None" and str(mad_multiplier_rtof).strip():
+            filter_params["mad_multiplier_rtof"] = float(mad_multiplier_rtof)
+        else:
+            # Default según el nivel
+            filter_params["mad_multiplier_rtof"] = 10.0 if high else 1000.0
+        print(f"[INFO] MAD multiplier RTOF: {filter_params['mad_multiplier_rtof']}")
+    except (ValueError, TypeError) as e:
+        filter_params["mad_multiplier_rtof"] = 10.0 if high else 1000.0
+        print(f"[WARNING] Error parseando mad_multiplier_rtof: {e}, usando default: {filter_params['mad_multiplier_rtof']}")
+
+    # CPS threshold RTOF
+    try:
+        if cps_threshold_rtof and cps_threshold_rtof != "None" and str(cps_threshold_rtof).strip():
+            filter_params["cps_threshold_rtof"] = float(cps_threshold_rtof)
+        else:
+            # Default según el nivel
+            filter_params["cps_threshold_rtof"] = 5.0 if high else 500.0
+        print(f"[INFO] CPS threshold RTOF: {filter_params['cps_threshold_rtof']}")
+    except (ValueError, TypeError) as e:
+        filter_params["cps_threshold_rtof"] = 5.0 if high else 500.0
+        print(f"[WARNING] Error parseando cps_threshold_rtof: {e}, usando default: {filter_params['cps_threshold_rtof']}")
+
+    # MAD multiplier DFMS
+    try:
+        if mad_multiplier_dfms and mad_multiplier_dfms != "None" and str(mad_multiplier_dfms).strip():
+            filter_params["mad_multiplier_dfms"] = float(mad_multiplier_dfms)
+        else:
+            # Default según el nivel
+            filter_params["mad_multiplier_dfms"] = 8.0 if high else 800.0
+        print(f"[INFO] MAD multiplier DFMS: {filter_params['mad_multiplier_dfms']}")
+    except (ValueError, TypeError) as e:
+        filter_params["mad_multiplier_dfms"] = 8.0 if high else 800.0
+        print(f"[WARNING] Error parseando mad_multiplier_dfms: {e}, usando default: {filter_params['mad_multiplier_dfms']}")
+
+    # CPS threshold DFMS
+    try:
+        if cps_threshold_dfms and cps_threshold_dfms != "None" and str(cps_threshold_dfms).strip():
+            filter_params["cps_threshold_dfms"] = float(cps_threshold_dfms)
+        else:
+            # Default según el nivel
+            filter_params["cps_threshold_dfms"] = 1e4 if high else 1e8
+        print(f"[INFO] CPS threshold DFMS: {filter_params['cps_threshold_dfms']}")
+    except (ValueError, TypeError) as e:
+        filter_params["cps_threshold_dfms"] = 1e4 if high else 1e8
+        print(f"[WARNING] Error parseando cps_threshold_dfms: {e}, usando default: {filter_params['cps_threshold_dfms']}")
+    
+    return filter_params
+
+
+def _summarize_non_negative(x_all, cps_all):
+    """
+    Resume el espectro en 100 bins usando sólo los cps no negativos.
+    
+    Returns:
+        Tupla (x_vals, cps_vals, spectrum_summary)
+    """
+    if len(x_all) == 0:
+        raise ValueError("El archivo está vacío o no contiene datos válidos")
+
+    # IMPORTANTE: Filtrar valores negativos antes del resumen
+    non_negative = cps_all >= 0
+    x_vals = x_all[non_negative]
+    cps_vals = cps_all[non_negative]
+    
+    if len(x_vals) == 0:
+        raise ValueError("No quedaron datos válidos (sin valores negativos) después del filtrado")
+
+    return x_vals, cps_vals, summarize_spectrum(x_vals, cps_vals, n_bins=100)
+
+
 @app.post("/process")
 async def process(
+    request: Request,
     file: UploadFile = File(...),
     filter_level: str = Form("high"),
     head_drop: Optional[str] = Form(None),
     mad_multiplier_rtof: Optional[str] = Form(None),
     cps_threshold_rtof: Optional[str] = Form(None),
     mad_multiplier_dfms: Optional[str] = Form(None),
-    cps_threshold_dfms: Optional[str] = Form(None)
+    cps_threshold_dfms: Optional[str] = Form(None),
+    precision: str = Form("float64"),
+    conclusion_mode: str = Form("model"),
+    calibrate: Optional[str] = Form(None)
 ):
     """
     Procesa un archivo .tab y genera un espectro resumido y una conclusión.
     
     Args:
-        file: Archivo .tab a procesar
-        filter_level: Nivel de filtrado ("high" para alto grado, "low" para bajo grado)
+        file: Archivo .tab a procesar (también .tab.gz, .tab.bz2, .tab.zst o .zip;
+            los comprimidos se descomprimen al vuelo sin cargarlos completos en memoria)
+        filter_level: Nivel de filtrado ("high" para alto grado, "low" para bajo grado,
+            "baseline" / "baseline_als" para alto grado con línea base local y MAD local)
         head_drop: (Opcional) Número de filas iniciales a descartar
         mad_multiplier_rtof: (Opcional) Multiplicador MAD para RTOF
         cps_threshold_rtof: (Opcional) Umbral absoluto de cps para RTOF
         mad_multiplier_dfms: (Opcional) Multiplicador MAD para DFMS
         cps_threshold_dfms: (Opcional) Umbral absoluto de cps para DFMS
+        precision: (Opcional) Precisión de cps: "float64" (default) o "float32".
+            En "float32" x se mantiene en float64 y cps se procesa en float32.
+        conclusion_mode: (Opcional) Cómo generar la conclusión:
+            "model" (default): modelo fine-tuneado con el espectro resumido
+            "digest": modelo con un prompt reducido (candidatos de la biblioteca local + picos principales)
+            "local": sin llamar al modelo, sólo candidatos de la biblioteca local
+        calibrate: (Opcional) "true" para calibrar la escala de m/z con los picos de
+            referencia (ajuste en caché por INSTRUMENT_MODE_ID y ventana de START_TIME).
+            Default: MZ_CALIBRATION
     """
     try:
-        # Validar que sea un archivo .tab
-        if not file.filename.endswith('.tab'):
+        # Validar que sea un archivo .tab (plano o comprimido)
+        try:
+            compression = tab_compression_from_filename(file.filename)
+        except ValueError as e:
             return JSONResponse(
                 status_code=400,
-                content={"error": "El archivo debe ser .tab"}
+                content={"error": str(e)}
             )
 
-        # Leer archivo en memoria
-        contents = await file.read()
-        tab_stream = io.BytesIO(contents)
+        if compression is None:
+            # Leer archivo en memoria
+            contents = await file.read()
+            upload_size = len(contents)
+            tab_stream = io.BytesIO(contents)
+            
+            # Leer metadata del detector ANTES de procesar (para no perder el stream)
+            from rosetta_pipeline import read_label_header_from_stream
+            meta = read_label_header_from_stream(tab_stream)
+        else:
+            # Comprimido: descomprimir en streaming desde el archivo temporal de la subida
+            print(f"[INFO] Archivo comprimido ({compression}): {file.filename}")
+            file.file.seek(0, os.SEEK_END)
+            upload_size = file.file.tell()
+            file.file.seek(0)
+            tab_stream = open_tab_text_stream(file.filename, file.file)
+            
+            # Leer sólo el encabezado; el stream queda al inicio de los datos
+            meta = read_label_header_from_lines(tab_stream)
+        detector = resolve_detector(meta)
         
-        # Leer metadata del detector ANTES de procesar (para no perder el stream)
-        from rosetta_pipeline import read_label_header_from_stream
-        meta = read_label_header_from_stream(tab_stream)
-        detector_id = meta.get('DETECTOR_ID', '').upper()
-        detector = "RTOF" if "RTOF" in detector_id else "DFMS" if "DFMS" in detector_id else "RTOF"
+        # Ajustar la reserva de memoria con ROWS del label
+        ticket = getattr(request.state, "admission_ticket", None)
+        if ticket is not None and meta.get('ROWS'):
+            cost = admission.estimate_cost(content_length=upload_size, rows=meta['ROWS'])
+            if not admission.try_grow(ticket, cost):
+                return _admission_error_response(AdmissionRejected(
+                    "Servidor ocupado, intenta de nuevo más tarde",
+                    retry_after=admission.retry_after
+                ))
         
         # Resetear el stream para procesar
-        tab_stream.seek(0)
+        if compression is None:
+            tab_stream.seek(0)
 
         # Validar filter_level
-        if filter_level not in ["high", "low"]:
+        if filter_level not in FILTER_LEVELS:
             filter_level = "high"  # Default a alto grado si es inválido
         
-        print(f"[INFO] Nivel de filtrado: {filter_level}")
-        print(f"[DEBUG] Detector detectado: {detector}")
-        
-        # Preparar parámetros de filtrado (aplican tanto para alto como bajo grado)
-        filter_params = {}
-        
-        # Head drop
-        try:
-            if head_drop and head_drop != "None" and str(head_drop).strip():
-                filter_params["head_drop"] = int(head_drop)
-            else:
-                filter_params["head_drop"] = 10 if detector == "RTOF" else 5
-            print(f"[INFO] Head drop: {filter_params['head_drop']}")
-        except (ValueError, TypeError) as e:
-            filter_params["head_drop"] = 10 if detector == "RTOF" else 5
-            print(f"[WARNING] Error parseando head_drop: {e}, usando default: {filter_params['head_drop']}")
-        
-        # MAD multiplier RTOF
-        try:
-            if mad_multiplier_rtof and mad_multiplier_rtof != "None" and str(mad_multiplier_rtof).strip():
-                filter_params["mad_multiplier_rtof"] = float(mad_multiplier_rtof)
-            else:
-                # Default según el nivel
-                filter_params["mad_multiplier_rtof"] = 10.0 if filter_level == "high" else 1000.0
-            print(f"[INFO] MAD multiplier RTOF: {filter_params['mad_multiplier_rtof']}")
-        except (ValueError, TypeError) as e:
-            filter_params["mad_multiplier_rtof"] = 10.0 if filter_level == "high" else 1000.0
-            print(f"[WARNING] Error parseando mad_multiplier_rtof: {e}, usando default: {filter_params['mad_multiplier_rtof']}")
-        
-        # CPS threshold RTOF
-        try:
-            if cps_threshold_rtof and cps_threshold_rtof != "None" and str(cps_threshold_rtof).strip():
-                filter_params["cps_threshold_rtof"] = float(cps_threshold_rtof)
-            else:
-                # Default según el nivel
-                filter_params["cps_threshold_rtof"] = 5.0 if filter_level == "high" else 500.0
-            print(f"[INFO] CPS threshold RTOF: {filter_params['cps_threshold_rtof']}")
-        except (ValueError, TypeError) as e:
-            filter_params["cps_threshold_rtof"] = 5.0 if filter_level == "high" else 500.0
-            print(f"[WARNING] Error parseando cps_threshold_rtof: {e}, usando default: {filter_params['cps_threshold_rtof']}")
+        # Validar precision
+        if precision not in ["float64", "float32"]:
+            precision = "float64"  # Default a precisión completa si es inválida
+        cps_dtype = resolve_precision(precision)
         
-        # MAD multiplier DFMS
-        try:
-            if mad_multiplier_dfms and mad_multiplier_dfms != "None" and str(mad_multiplier_dfms).strip():
-                filter_params["mad_multiplier_dfms"] = float(mad_multiplier_dfms)
-            else:
-                # Default según el nivel
-                filter_params["mad_multiplier_dfms"] = 8.0 if filter_level == "high" else 800.0
-            print(f"[INFO] MAD multiplier DFMS: {filter_params['mad_multiplier_dfms']}")
-        except (ValueError, TypeError) as e:
-            filter_params["mad_multiplier_dfms"] = 8.0 if filter_level == "high" else 800.0
-            print(f"[WARNING] Error parseando mad_multiplier_dfms: {e}, usando default: {filter_params['mad_multiplier_dfms']}")
+        # Validar conclusion_mode
+        if conclusion_mode not in ["model", "digest", "local"]:
+            conclusion_mode = "model"  # Default al modelo si es inválido
         
-        # CPS threshold DFMS
-        try:
-            if cps_threshold_dfms and cps_threshold_dfms != "None" and str(cps_threshold_dfms).strip():
-                filter_params["cps_threshold_dfms"] = float(cps_threshold_dfms)
-            else:
-                # Default según el nivel
-                filter_params["cps_threshold_dfms"] = 1e4 if filter_level == "high" else 1e8
-            print(f"[INFO] CPS threshold DFMS: {filter_params['cps_threshold_dfms']}")
-        except (ValueError, TypeError) as e:
-            filter_params["cps_threshold_dfms"] = 1e4 if filter_level == "high" else 1e8
-            print(f"[WARNING] Error parseando cps_threshold_dfms: {e}, usando default: {filter_params['cps_threshold_dfms']}")
+        print(f"[INFO] Nivel de filtrado: {filter_level}")
+        print(f"[INFO] Precisión de cps: {precision}")
+        print(f"[DEBUG] Detector detectado: {detector}")
         
+        filter_params = _build_filter_params(
+            detector, filter_level, head_drop, mad_multiplier_rtof, cps_threshold_rtof,
+            mad_multiplier_dfms, cps_threshold_dfms
+        )
         print(f"[DEBUG] Parámetros de filtrado finales: {filter_params}")
 
         # Procesar el archivo .tab con el nivel de filtrado especificado
-        df = process_tab_file(tab_stream, filter_level=filter_level, **filter_params)
+        if compression is None:
+            _, best_x, best_y = read_tab_xy(tab_stream, parse_workers=PARSE_WORKERS)
+        else:
+            try:
+                _, best_x, best_y = read_tab_xy_lines(tab_stream, meta=meta)
+            finally:
+                tab_stream.close()
 
-        if df.empty:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "El archivo está vacío o no contiene datos válidos"}
-            )
+        # Calibrar m/z antes de guardar: /refilter reutiliza el x calibrado
+        calibration = None
+        if _parse_flag(calibrate, CALIBRATION_DEFAULT):
+            best_x, calibration = calibrate_xy(best_x, best_y, meta, detector)
+
+        # Guardar el espectro parseado para /refilter y limpiar con su índice
+        spectrum_id = spectrum_cache.put(best_x, best_y, detector)
+        # Con el backend file otro worker puede expulsar la entrada antes de leerla:
+        # en ese caso el índice se construye con los arrays locales
+        entry = spectrum_cache.get(spectrum_id) or CachedSpectrum(best_x, best_y, detector)
+        index = entry.get_index(filter_level, filter_params["head_drop"], cps_dtype)
+        spectrum_cache.trim()
+        x_all, cps_all = index.apply(**filter_params)
+
+        if len(x_all) == 0:
+            raise ValueError("No quedaron datos válidos después de la limpieza")
 
         # Resumir el espectro en 100 bins
-        # IMPORTANTE: Filtrar valores negativos antes del resumen
-        df_summary = df[df['cps'] >= 0].copy()
-        
-        if df_summary.empty:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "No quedaron datos válidos (sin valores negativos) después del filtrado"}
+        x_vals, cps_vals, spectrum_summary = _summarize_non_negative(x_all, cps_all)
+
+        # Emparejamiento local contra la biblioteca de referencia (milisegundos).
+        # Se usa el espectro centrado sin umbrales: los umbrales de cps/MAD
+        # eliminan justamente los picos que hay que emparejar
+        try:
+            candidates = entry.get_candidates(filter_level, filter_params["head_drop"], cps_dtype)
+        except Exception as e:
+            print(f"[WARNING] Error en el emparejamiento local: {e}")
+            candidates = []
+        print(f"[INFO] Candidatos de la biblioteca local: {[c['species'] for c in candidates]}")
+
+        if conclusion_mode == "digest":
+            # Prompt reducido: candidatos + los 20 bins más intensos
+            top_bins = sorted(spectrum_summary, key=lambda p: p['cps'], reverse=True)[:20]
+            spectrum_pairs = " ".join([
+                f"{p['x']:.3f}:{p['cps']:.3f}"
+                for p in sorted(top_bins, key=lambda p: p['x'])
+            ])
+            input_text = (
+                f"Detector: {detector}\n"
+                f"Candidatos (biblioteca local):\n{format_candidates(candidates)}\n"
+                f"Picos principales (m/z:cps): {spectrum_pairs}"
             )
-        
-        x_vals = df_summary['x'].to_numpy()
-        cps_vals = df_summary['cps'].to_numpy()
-
-        bins = np.linspace(x_vals.min(), x_vals.max(), 101)
-        spectrum_summary = []
-
-        for i in range(100):
-            mask = (x_vals >= bins[i]) & (x_vals < bins[i+1])
-            if mask.any():
-                # Calcular promedio solo de valores no negativos en este bin
-                bin_cps = cps_vals[mask]
-                bin_cps_positive = bin_cps[bin_cps >= 0]
-                
-                if len(bin_cps_positive) > 0:
-                    spectrum_summary.append({
-                        "x": float(x_vals[mask].mean()),
-                        "cps": float(bin_cps_positive.mean())
-                    })
-
-        # Construir input para el modelo con los datos del espectro y metadata
-        # Formato: pares x:cps como en Google Colab
-        spectrum_pairs = " ".join([
-            f"{p['x']:.3f}:{p['cps']:.3f}"
-            for p in spectrum_summary
-        ])
-        
-        # Construir el input completo con metadata del detector y datos del espectro
-        input_text = f"Detector: {detector}\nEspectro (m/z:cps): {spectrum_pairs}"
+        else:
+            # Construir input para el modelo con los datos del espectro y metadata
+            # Formato: pares x:cps como en Google Colab
+            spectrum_pairs = " ".join([
+                f"{p['x']:.3f}:{p['cps']:.3f}"
+                for p in spectrum_summary
+            ])
+            
+            # Construir el input completo con metadata del detector y datos del espectro
+            input_text = f"Detector: {detector}\nEspectro (m/z:cps): {spectrum_pairs}"
         
         print(f"[DEBUG] ========== CONSTRUYENDO INPUT PARA OPENAI ==========")
         print(f"[DEBUG] Detector: {detector}")
@@ -224,7 +427,9 @@ async def process(
 
         # Llamar al modelo fine-tuneado de OpenAI usando el prompt ID
         conclusion = ""
-        if OPENAI_API_KEY:
+        if conclusion_mode == "local":
+            conclusion = f"Candidatos de la biblioteca de referencia:\n{format_candidates(candidates)}"
+        elif OPENAI_API_KEY:
             try:
                 import requests
                 
@@ -424,9 +629,13 @@ async def process(
             conclusion = "OPENAI_API_KEY no configurada. Por favor, configura tu API key en el archivo .env"
 
         return {
+            "spectrum_id": spectrum_id,
             "spectrum": spectrum_summary,
             "conclusion": conclusion,
-            "total_points": len(df),
+            "candidates": candidates,
+            "calibration": calibration.to_dict() if calibration else None,
+            "total_points": len(x_all),
+            "precision": precision,
             "x_range": {
                 "min": float(x_vals.min()),
                 "max": float(x_vals.max())
@@ -448,3 +657,88 @@ async def process(
             content={"error": f"Error al procesar el archivo: {str(e)}"}
         )
 
+
+@app.post("/refilter")
+async def refilter(
+    spectrum_id: str = Form(...),
+    filter_level: str = Form("high"),
+    head_drop: Optional[str] = Form(None),
+    mad_multiplier_rtof: Optional[str] = Form(None),
+    cps_threshold_rtof: Optional[str] = Form(None),
+    mad_multiplier_dfms: Optional[str] = Form(None),
+    cps_threshold_dfms: Optional[str] = Form(None),
+    precision: str = Form("float64")
+):
+    """
+    Vuelve a filtrar un espectro ya procesado por /process con nuevos umbrales,
+    sin volver a subir ni parsear el archivo y sin llamar al modelo.
+    
+    Args:
+        spectrum_id: Identificador retornado por /process
+        (resto de parámetros iguales a /process)
+    """
+    try:
+        entry = spectrum_cache.get(spectrum_id)
+        if entry is None:
+            return JSONResponse(
+                status_code=404,
+                content={"error": "El espectro ya no está disponible, vuelve a subir el archivo"}
+            )
+
+        # Validar filter_level
+        if filter_level not in FILTER_LEVELS:
+            filter_level = "high"  # Default a alto grado si es inválido
+        
+        # Validar precision
+        if precision not in ["float64", "float32"]:
+            precision = "float64"  # Default a precisión completa si es inválida
+        cps_dtype = resolve_precision(precision)
+
+        filter_params = _build_filter_params(
+            entry.detector, filter_level, head_drop, mad_multiplier_rtof, cps_threshold_rtof,
+            mad_multiplier_dfms, cps_threshold_dfms
+        )
+
+        # Sólo un cambio de head_drop / filter_level / precisión construye un índice nuevo
+        index = entry.get_index(filter_level, filter_params["head_drop"], cps_dtype)
+        spectrum_cache.trim()
+        x_all, cps_all = index.apply(**filter_params)
+
+        if len(x_all) == 0:
+            raise ValueError("No quedaron datos válidos después de la limpieza")
+
+        x_vals, cps_vals, spectrum_summary = _summarize_non_negative(x_all, cps_all)
+
+        # Los candidatos sólo dependen del índice: se reutilizan entre sliders
+        try:
+            candidates = entry.get_candidates(filter_level, filter_params["head_drop"], cps_dtype)
+        except Exception as e:
+            print(f"[WARNING] Error en el emparejamiento local: {e}")
+            candidates = []
+
+        return {
+            "spectrum_id": spectrum_id,
+            "spectrum": spectrum_summary,
+            "candidates": candidates,
+            "total_points": len(x_all),
+            "precision": precision,
+            "x_range": {
+                "min": float(x_vals.min()),
+                "max": float(x_vals.max())
+            },
+            "cps_range": {
+                "min": float(cps_vals.min()),
+                "max": float(cps_vals.max())
+            }
+        }
+
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error al refiltrar el espectro: {str(e)}"}
+        )
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Estimación de línea base y de ruido local para la limpieza robusta.
+
+En barridos largos la línea base deriva, así que restar una única mediana
+global filtra de más en un extremo y de menos en el otro. Aquí la línea base
+se estima localmente (en el orden de adquisición) y el ruido es un MAD local,
+que reemplaza al MAD global en los umbrales de _robust_clean_arrays.
+
+Métodos:
+    rolling: mediana móvil. Las ventanas se evalúan cada media ventana (con
+             solape) y se interpolan linealmente, así que el coste es lineal en
+             el número de puntos.
+    als:     mínimos cuadrados asimétricos (Eilers) sobre medianas por bloques,
+             resueltos con un sistema pentadiagonal e interpolados a todos los
+             puntos.
+
+Variables de entorno:
+    BASELINE_WINDOW:      puntos por ventana de la mediana móvil y del MAD local (default: 501)
+    BASELINE_ALS_LAMBDA:  suavizado del ALS (default: 1e4)
+    BASELINE_ALS_P:       asimetría del ALS (default: 0.01)
+    BASELINE_ALS_NODES:   nodos (bloques) sobre los que se resuelve el ALS (default: 2048)
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from env_config import env_float
+
+
+BASELINE_WINDOW = int(env_float("BASELINE_WINDOW", 501))
+ALS_LAMBDA = env_float("BASELINE_ALS_LAMBDA", 1e4)
+ALS_P = env_float("BASELINE_ALS_P", 0.01)
+ALS_NODES = int(env_float("BASELINE_ALS_NODES", 2048))
+ALS_ITERATIONS = 10
+
+# Elementos máximos copiados a la vez al evaluar ventanas (acota la memoria)
+_BATCH_ELEMENTS = 1 << 22
+
+
+def _window_medians(y, window, step):
+    """
+    Medianas de las ventanas y[s:s+window] con s = 0, step, 2*step, ...
+    (la última ventana siempre termina en el último punto).
+
+    Returns:
+        Tupla (centros, medianas) con el índice central de cada ventana
+    """
+    n = len(y)
+    window = max(1, min(int(window), n))
+    step = max(1, int(step))
+
+    starts = np.arange(0, n - window + 1, step)
+    if starts[-1] != n - window:
+        starts = np.append(starts, n - window)
+
+    view = sliding_window_view(y, window)
+    medians = np.empty(len(starts), dtype=np.float64)
+    batch = max(1, _BATCH_ELEMENTS // window)
+    for i in range(0, len(starts), batch):
+        medians[i:i + batch] = np.median(view[starts[i:i + batch]], axis=1)
+
+    return starts + (window - 1) / 2.0, medians
+
+
+def rolling_median(y, window=None):
+    """Mediana móvil de `y` (float64), interpolada entre ventanas solapadas."""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n == 0:
+        return y.copy()
+    window = int(window or BASELINE_WINDOW)
+    if window >= n:
+        return np.full(n, np.median(y))
+
+    centers, medians = _window_medians(y, window, window // 2)
+    return np.interp(np.arange(n), centers, medians)
+
+
+def _solve_pentadiagonal(d0, d1, d2, rhs):
+    """
+    Resuelve A z = rhs con A simétrica pentadiagonal (diagonal d0, primera
+    subdiagonal d1 y segunda subdiagonal d2) mediante una factorización LDLᵀ.
+    """
+    m = len(d0)
+    d = [0.0] * m
+    a = [0.0] * m  # L[i+1, i]
+    b = [0.0] * m  # L[i+2, i]
+    d0, d1, d2, rhs = d0.tolist(), d1.tolist(), d2.tolist(), rhs.tolist()
+
+    for i in range(m):
+        di = d0[i]
+        if i >= 1:
+            di -= a[i - 1] * a[i - 1] * d[i - 1]
+        if i >= 2:
+            di -= b[i - 2] * b[i - 2] * d[i - 2]
+        d[i] = di
+        if i + 1 < m:
+            ai = d1[i]
+            if i >= 1:
+                ai -= b[i - 1] * a[i - 1] * d[i - 1]
+            a[i] = ai / di
+        if i + 2 < m:
+            b[i] = d2[i] / di
+
+    z = [0.0] * m
+    for i in range(m):
+        zi = rhs[i]
+        if i >= 1:
+            zi -= a[i - 1] * z[i - 1]
+        if i >= 2:
+            zi -= b[i - 2] * z[i - 2]
+        z[i] = zi
+
+    out = [0.0] * m
+    for i in range(m - 1, -1, -1):
+        oi = z[i] / d[i]
+        if i + 1 < m:
+            oi -= a[i] * out[i + 1]
+        if i + 2 < m:
+            oi -= b[i] * out[i + 2]
+        out[i] = oi
+
+    return np.array(out)
+
+
+def als_baseline(y, lam=None, p=None, nodes=None, n_iter=ALS_ITERATIONS):
+    """
+    Línea base por mínimos cuadrados asimétricos (penalización de segundas
+    diferencias). Se resuelve sobre medianas por bloques y se interpola, así
+    que el coste es lineal en len(y) más O(nodes) por iteración.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n == 0:
+        return y.copy()
+    lam = ALS_LAMBDA if lam is None else float(lam)
+    p = ALS_P if p is None else float(p)
+    nodes = int(nodes or ALS_NODES)
+
+    block = max(1, -(-n // nodes))
+    centers, v = _window_medians(y, block, block)
+    m = len(v)
+    if m < 3:
+        return np.full(n, np.median(y))
+
+    # Diagonales de DᵀD (D = segundas diferencias, m - 2 filas [1, -2, 1]):
+    # cada fila suma [1, 4, 1] a la diagonal y [-2, -2] a la primera superdiagonal
+    rows = np.ones(m - 2)
+    dd0 = np.convolve(rows, [1.0, 4.0, 1.0])
+    dd1 = np.convolve(rows, [-2.0, -2.0])
+    dd2 = rows
+
+    w = np.ones(m)
+    z = v
+    for _ in range(int(n_iter)):
+        z = _solve_pentadiagonal(w + lam * dd0, lam * dd1, lam * dd2, w * v)
+        w_new = np.where(v > z, p, 1.0 - p)
+        if np.array_equal(w_new, w):
+            break
+        w = w_new
+
+    return np.interp(np.arange(n), centers, z)
+
+
+def local_mad(residual, window=None):
+    """
+    MAD local de un residuo ya centrado (mediana móvil de |residual|).
+    Tiene la misma escala que el MAD global de _robust_center.
+    """
+    return rolling_median(np.abs(np.asarray(residual, dtype=np.float64)), window)
+
+
+def estimate_baseline(y, method="rolling", window=None):
+    """
+    Estima la línea base y el ruido local de `y`.
+
+    Args:
+        y: intensidades en orden de adquisición
+        method: "rolling" (mediana móvil) o "als" (mínimos cuadrados asimétricos)
+        window: puntos por ventana (default: BASELINE_WINDOW)
+
+    Returns:
+        Tupla (baseline, noise) de arrays float64 del mismo largo que `y`
+    """
+    y = np.asarray(y, dtype=np.float64)
+    if method == "als":
+        baseline = als_baseline(y)
+    elif method == "rolling":
+        baseline = rolling_median(y, window)
+    else:
+        raise ValueError(f"Método de línea base desconocido: {method}")
+    return baseline, local_mad(y - baseline, window)
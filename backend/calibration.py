@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Calibración de la escala de masas (m/z) entre archivos.
+
+La columna x de DFMS/RTOF se usa tal cual como m/z, así que espectros de
+distintos productos y modos quedan desplazados entre sí. Aquí se ajusta, por
+detector, INSTRUMENT_MODE_ID y ventana de tiempo (START_TIME), un polinomio
+m/z_real = polyval(coef, x) con los picos de referencia de la biblioteca local
+(data/species_masses.csv) que aparecen en el espectro, y se aplica a todo el
+array x de una vez con np.polyval.
+
+El primer archivo de cada (detector, modo, ventana) con un ajuste válido lo
+deja en la caché; los siguientes de la misma clave reutilizan ese ajuste, así
+que todos quedan en la misma escala. Si dos workers ajustan la misma clave a
+la vez, el segundo adopta el ajuste que ya guardó el primero. Si no hay
+ajuste en caché ni picos suficientes, x no se modifica. Los archivos sin
+INSTRUMENT_MODE_ID o sin START_TIME legible se ajustan solos y no pasan por
+la caché (no se sabe con qué otros archivos comparten escala).
+
+Variables de entorno:
+    MZ_CALIBRATION:            "1" para calibrar por defecto en /process (default: 0)
+    CALIBRATION_DEGREE:        grado del polinomio (default: 1, desplazamiento y escala)
+    CALIBRATION_MIN_PEAKS:     picos de referencia mínimos para aceptar un ajuste (default: 3)
+    CALIBRATION_SNR_MIN:       SNR mínimo de un pico de referencia (default: 10)
+    CALIBRATION_WINDOW_HOURS:  ancho de la ventana de tiempo de la caché en horas (default: 24)
+    CALIBRATION_CACHE_PATH:    archivo JSON para compartir los ajustes entre workers
+                               y reinicios (default: sólo en memoria)
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from env_config import env_float, env_int
+from species_matching import get_default_library
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo se bloquea dentro del proceso
+    fcntl = None
+
+
+CALIBRATION_DEFAULT = os.getenv("MZ_CALIBRATION", "0").strip().lower() in ("1", "true", "on", "yes")
+CALIBRATION_DEGREE = max(1, env_int("CALIBRATION_DEGREE", 1))
+CALIBRATION_MIN_PEAKS = max(3, env_int("CALIBRATION_MIN_PEAKS", 3))
+CALIBRATION_SNR_MIN = env_float("CALIBRATION_SNR_MIN", 10.0)
+CALIBRATION_WINDOW_HOURS = max(1e-3, env_float("CALIBRATION_WINDOW_HOURS", 24.0))
+CALIBRATION_CACHE_PATH = os.getenv("CALIBRATION_CACHE_PATH", "").strip()
+
+# Ventana de búsqueda de cada pico de referencia en la escala sin calibrar:
+# max(tol_abs, mz * tol_ppm * 1e-6). Otros detectores no se calibran.
+SEARCH_TOLERANCES = {
+    "DFMS": {"tol_abs": 0.05, "tol_ppm": 500.0},
+    "RTOF": {"tol_abs": 0.3, "tol_ppm": 0.0},
+}
+
+# Puntos a cada lado del máximo para el centroide de un pico
+_CENTROID_HALF_WIDTH = 2
+
+# Ajustes guardados en memoria por proceso
+_MAX_CACHE_ENTRIES = 1024
+
+
+class MassCalibration:
+    """Polinomio de calibración m/z_real = polyval(coef, x) de una clave de caché."""
+
+    def __init__(self, coef, key, n_peaks, rms, x_range):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.key = key
+        self.n_peaks = int(n_peaks)
+        self.rms = float(rms)
+        self.x_range = (float(x_range[0]), float(x_range[1]))
+
+    def apply(self, x):
+        """Aplica la calibración a un array de x (retorna un array float64 nuevo)."""
+        return np.polyval(self.coef, np.asarray(x, dtype=np.float64))
+
+    def to_dict(self):
+        return {
+            "key": self.key,
+            "coef": self.coef.tolist(),
+            "n_peaks": self.n_peaks,
+            "rms": self.rms,
+            "x_range": list(self.x_range),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["coef"], data["key"], data["n_peaks"], data["rms"], data["x_range"])
+
+
+def _time_window(start_time, hours):
+    """Inicio (ISO, UTC) de la ventana de `hours` horas que contiene START_TIME, o '' si no se puede leer."""
+    value = (start_time or "").strip().strip('"')
+    if not value:
+        return ""
+    try:
+        t = datetime.fromisoformat(value.rstrip("Z"))
+    except ValueError:
+        return ""
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    width = hours * 3600.0
+    start = math.floor(t.timestamp() / width) * width
+    return datetime.fromtimestamp(start, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def calibration_key(meta, detector, window_hours=None):
+    """
+    Clave de caché "DETECTOR|INSTRUMENT_MODE_ID|inicio de la ventana", o None
+    si falta el modo o START_TIME no se puede leer.
+    """
+    mode = (meta.get('INSTRUMENT_MODE_ID') or '').strip().strip('"').upper()
+    window = _time_window(meta.get('START_TIME'), window_hours or CALIBRATION_WINDOW_HOURS)
+    if not mode or not window:
+        return None
+    return f"{detector.upper()}|{mode}|{window}"
+
+
+def _reference_lines(library, x_min, x_max, tol_abs, tol_ppm):
+    """
+    Líneas principales de las especies de la biblioteca dentro del rango medido
+    cuyas ventanas de búsqueda no se solapan con otra línea principal (p. ej.
+    CO+ y N2+ en 28 no sirven para calibrar).
+    """
+    ref = np.unique(library.mz[library.main_line])
+    tol = np.maximum(tol_abs, ref * tol_ppm * 1e-6)
+    gap = np.diff(ref)
+    isolated = np.ones(len(ref), dtype=bool)
+    isolated[1:] &= gap > tol[1:] + tol[:-1]
+    isolated[:-1] &= gap > tol[1:] + tol[:-1]
+    keep = isolated & (ref - tol >= x_min) & (ref + tol <= x_max)
+    return ref[keep], tol[keep]
+
+
+def find_reference_peaks(x, y, detector="DFMS", library=None, snr_min=None):
+    """
+    Busca las líneas principales de la biblioteca en un espectro sin calibrar.
+
+    Un pico cuenta si su máximo supera snr_min y tiene al menos dos puntos
+    sobre la mitad de su altura (un único punto es un pico espurio). Su
+    posición es el centroide ponderado por intensidad alrededor del máximo.
+
+    Returns:
+        Tupla (x_obs, mz_ref) de arrays con los pares encontrados
+    """
+    tols = SEARCH_TOLERANCES.get(detector.upper())
+    empty = (np.empty(0), np.empty(0))
+    if tols is None or len(x) == 0:
+        return empty
+    library = library or get_default_library()
+    snr_min = CALIBRATION_SNR_MIN if snr_min is None else snr_min
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    order = np.argsort(x, kind='stable')
+    xs, ys = x[order], y[order]
+
+    ref_mz, tol = _reference_lines(library, xs[0], xs[-1], tols["tol_abs"], tols["tol_ppm"])
+    if len(ref_mz) == 0:
+        return empty
+
+    # Ruido robusto del espectro (igual que match_spectrum)
+    base = np.median(ys)
+    sigma = 1.4826 * np.median(np.abs(ys - base)) + 1e-12
+
+    lo = np.searchsorted(xs, ref_mz - tol, side='left')
+    hi = np.searchsorted(xs, ref_mz + tol, side='right')
+
+    x_obs, mz_ref = [], []
+    for line in np.flatnonzero(hi - lo >= 3):
+        window = ys[lo[line]:hi[line]]
+        i = int(np.argmax(window))
+        height = window[i] - base
+        if height / sigma < snr_min or np.count_nonzero(window - base >= height / 2) < 2:
+            continue
+        a = max(0, i - _CENTROID_HALF_WIDTH)
+        b = min(len(window), i + _CENTROID_HALF_WIDTH + 1)
+        weights = np.maximum(window[a:b] - base, 0.0)
+        x_obs.append(np.dot(xs[lo[line] + a:lo[line] + b], weights) / weights.sum())
+        mz_ref.append(ref_mz[line])
+
+    return np.array(x_obs, dtype=np.float64), np.array(mz_ref, dtype=np.float64)
+
+
+def fit_calibration(x, y, detector="DFMS", key="", library=None, degree=None, min_peaks=None):
+    """
+    Ajusta el polinomio de calibración de un espectro sin calibrar.
+
+    Se descartan los picos con residuo mayor a 3 MAD del primer ajuste y se
+    vuelve a ajustar. El polinomio tiene que ser creciente en el rango medido.
+
+    Returns:
+        MassCalibration, o None si no hay picos suficientes o el ajuste no es válido
+    """
+    degree = CALIBRATION_DEGREE if degree is None else degree
+    min_peaks = CALIBRATION_MIN_PEAKS if min_peaks is None else min_peaks
+
+    x_obs, mz_ref = find_reference_peaks(x, y, detector, library)
+    if len(x_obs) < min_peaks:
+        return None
+
+    def polyfit(xo, mr):
+        # Al menos un grado de libertad para estimar el residuo
+        return np.polyfit(xo, mr, max(1, min(degree, len(xo) - 2)))
+
+    coef = polyfit(x_obs, mz_ref)
+    residual = mz_ref - np.polyval(coef, x_obs)
+    mad = 1.4826 * np.median(np.abs(residual - np.median(residual)))
+    keep = np.abs(residual) <= max(3.0 * mad, 1e-9)
+    if keep.sum() >= min_peaks and not keep.all():
+        x_obs, mz_ref = x_obs[keep], mz_ref[keep]
+        coef = polyfit(x_obs, mz_ref)
+        residual = mz_ref - np.polyval(coef, x_obs)
+
+    x_range = (float(np.min(x)), float(np.max(x)))
+    grid = np.polyval(coef, np.linspace(x_range[0], x_range[1], 64))
+    if not np.all(np.isfinite(coef)) or np.any(np.diff(grid) <= 0):
+        print(f"[WARNING] Calibración de m/z descartada ({key}): el polinomio no es creciente")
+        return None
+
+    rms = float(np.sqrt(np.mean(residual ** 2)))
+    return MassCalibration(coef, key, len(x_obs), rms, x_range)
+
+
+class CalibrationCache:
+    """
+    Ajustes de calibración por clave. En memoria (LRU por proceso) y,
+    si se indica `path`, también en un archivo JSON compartido. La lectura,
+    modificación y escritura del archivo se hace con un bloqueo (flock sobre
+    `<path>.lock`) para que dos workers no se pisen las claves.
+    """
+
+    def __init__(self, path=None, max_entries=_MAX_CACHE_ENTRIES):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read_file(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] No se pudo leer la caché de calibración {self.path}: {e}")
+            return {}
+
+    @contextmanager
+    def _file_lock(self):
+        """Bloqueo exclusivo del archivo entre procesos (sin fcntl, sólo el del proceso)."""
+        if fcntl is None:
+            yield
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_file(self, data):
+        # Escritura atómica: otros workers leen el archivo completo o el anterior
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=".calibration-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[WARNING] No se pudo guardar la caché de calibración {self.path}: {e}")
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _remember(self, calibration):
+        self._entries[calibration.key] = calibration
+        self._entries.move_to_end(calibration.key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            calibration = self._entries.get(key)
+            if calibration is not None:
+                self._entries.move_to_end(key)
+                return calibration
+            if self.path is not None:
+                data = self._read_file().get(key)
+                if data is not None:
+                    calibration = MassCalibration.from_dict(data)
+                    self._remember(calibration)
+            return calibration
+
+    def put(self, calibration):
+        """
+        Guarda un ajuste nuevo. Si la clave ya tiene un ajuste (de otro hilo o
+        de otro worker) se conserva ese y se retorna; si no, retorna `calibration`.
+        """
+        with self._lock:
+            existing = self._entries.get(calibration.key)
+            if existing is None and self.path is not None:
+                with self._file_lock():
+                    data = self._read_file()
+                    if calibration.key in data:
+                        existing = MassCalibration.from_dict(data[calibration.key])
+                    else:
+                        data[calibration.key] = calibration.to_dict()
+                        self._write_file(data)
+            calibration = existing or calibration
+            self._remember(calibration)
+            return calibration
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.path is not None:
+                with self._file_lock():
+                    if self.path.exists():
+                        self.path.unlink()
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """Caché por defecto (CALIBRATION_CACHE_PATH o sólo en memoria)."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CalibrationCache(CALIBRATION_CACHE_PATH or None)
+    return _default_cache
+
+
+def calibrate_xy(x, y, meta, detector, cache=None):
+    """
+    Calibra la escala de masas de un espectro sin limpiar.
+
+    Usa el ajuste en caché de (detector, INSTRUMENT_MODE_ID, ventana de
+    START_TIME) si existe; si no, lo ajusta con este espectro y lo guarda.
+    Sin modo o sin START_TIME el ajuste es sólo de este espectro.
+
+    Returns:
+        Tupla (x_calibrado, MassCalibration o None). Sin calibración, x se
+        retorna sin cambios.
+    """
+    if detector.upper() not in SEARCH_TOLERANCES:
+        return x, None
+    cache = cache or get_default_cache()
+    key = calibration_key(meta, detector)
+
+    calibration = cache.get(key) if key is not None else None
+    if calibration is None:
+        calibration = fit_calibration(x, y, detector, key=key or "")
+        label = key or f"{detector.upper()}, sin modo o START_TIME: no se guarda"
+        if calibration is None:
+            print(f"[INFO] Calibración de m/z ({label}): sin picos de referencia suficientes, x sin cambios")
+            return x, None
+        if key is not None:
+            calibration = cache.put(calibration)
+        print(f"[INFO] Calibración de m/z ({label}): {calibration.n_peaks} picos, "
+              f"rms {calibration.rms:.2e}, coef {calibration.coef.tolist()}")
+
+    return calibration.apply(x), calibration
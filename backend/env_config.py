@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Lectura de variables de entorno numéricas compartida por los módulos del backend.
+
+Un valor que no se puede convertir no detiene el arranque: se avisa en el log
+y se usa el default.
+"""
+import os
+
+
+def env_float(name, default):
+    """Valor float de la variable `name` (default si falta o no es válido)."""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        print(f"[WARNING] Valor inválido para {name}, usando default: {default}")
+        return float(default)
+
+
+def env_int(name, default):
+    """Valor int de la variable `name` (default si falta o no es válido)."""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        print(f"[WARNING] Valor inválido para {name}, usando default: {default}")
+        return int(default)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Perfil de despliegue multi-worker: gunicorn con workers de uvicorn.
+
+    gunicorn app:app -c gunicorn.conf.py
+
+Cada worker es un intérprete de Python propio, así que las subidas se
+procesan en paralelo en todos los núcleos. Con más de un worker la caché de
+/refilter pasa al backend file (ver spectrum_cache.py) para que un
+spectrum_id funcione en cualquier worker, y los ajustes de calibración de m/z
+se comparten en un archivo (ver calibration.py).
+
+Variables de entorno:
+    PORT:              puerto (default: 8000)
+    WEB_CONCURRENCY:   número de workers (default: núcleos / PARSE_WORKERS, entre 2 y 8)
+    GUNICORN_TIMEOUT:  segundos máximos por petición (default: 180)
+    GUNICORN_MAX_REQUESTS: peticiones antes de reciclar un worker (default: 500)
+
+ADMISSION_MAX_INFLIGHT_MB es el presupuesto de toda la máquina: aquí se
+reparte entre los workers, porque cada uno tiene su propio control de admisión.
+"""
+import os
+import tempfile
+
+
+def _default_workers():
+    cores = os.cpu_count() or 1
+    # Cada worker puede lanzar PARSE_WORKERS procesos de parseo: no sobresuscribir
+    try:
+        parse_workers = max(1, int(os.getenv("PARSE_WORKERS", 0)))
+    except ValueError:
+        parse_workers = 1
+    return max(2, min(8, cores // parse_workers))
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", _default_workers()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# El parseo de archivos grandes y la llamada al modelo pueden tardar
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 180))
+graceful_timeout = 30
+keepalive = 5
+
+# Reciclar workers acota la fragmentación de memoria de los arrays grandes
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 500))
+max_requests_jitter = max_requests // 10
+
+# Sin preload: cada worker crea sus propios recursos (pool de parseo, caché local)
+preload_app = False
+accesslog = "-"
+
+# Presupuesto de admisión por worker. El total original se guarda aparte para
+# no volver a dividirlo si gunicorn relee este archivo (HUP)
+os.environ.setdefault("ADMISSION_TOTAL_INFLIGHT_MB", os.getenv("ADMISSION_MAX_INFLIGHT_MB", "1024"))
+try:
+    _total_inflight_mb = float(os.environ["ADMISSION_TOTAL_INFLIGHT_MB"])
+except ValueError:
+    _total_inflight_mb = 1024.0
+os.environ["ADMISSION_MAX_INFLIGHT_MB"] = str(_total_inflight_mb / max(1, workers))
+
+if workers > 1:
+    # La caché en memoria es por proceso: compartirla entre workers
+    os.environ.setdefault("SPECTRUM_CACHE_BACKEND", "file")
+    os.environ.setdefault("CALIBRATION_CACHE_PATH", os.path.join(tempfile.gettempdir(), "rosetta_calibration.json"))
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Parseo en paralelo de la sección de datos (post-END) de un único archivo .tab.
+
+La sección de datos se divide en trozos por saltos de línea y cada trozo se
+clasifica (_is_numeric_line) y parsea (_xy_arrays_from_block) en un proceso
+del pool. Los bloques numéricos que cruzan el borde entre dos trozos se
+vuelven a unir, así que el resultado es idéntico a
+_read_post_end_lines + _slice_numeric_blocks + _xy_arrays_from_block.
+
+Se usan procesos (no hilos) porque el parseo línea a línea es Python puro y
+no libera el GIL. El archivo y los arrays parseados pasan entre procesos por
+multiprocessing.shared_memory (sólo se serializan nombres y offsets), así que
+los datos no se copian a través del pipe del pool.
+
+Variables de entorno:
+    PARSE_WORKERS:              procesos de parseo (default: 0 = serial)
+    PARALLEL_PARSE_MIN_MB:      tamaño mínimo del archivo para paralelizar (default: 32)
+"""
+import atexit
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from env_config import env_float, env_int
+from readers import parse_uniform_lines
+from rosetta_pipeline import _is_numeric_line, _xy_arrays_from_block
+
+
+PARSE_WORKERS = env_int("PARSE_WORKERS", 0)
+MIN_PARALLEL_BYTES = int(env_float("PARALLEL_PARSE_MIN_MB", 32) * 1024 * 1024)
+
+_pool = None
+_pool_workers = 0
+
+
+def _get_pool(workers):
+    """Pool de procesos compartido (se crea la primera vez que se usa)."""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        # spawn: evita heredar hilos/locks del servidor al hacer fork
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def _reset_pool():
+    """Descarta el pool (p. ej. roto porque un proceso murió); se recrea en el próximo uso."""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+    _pool_workers = 0
+
+
+def _release_part(part):
+    """Libera el segmento de un trozo parseado que no se va a usar."""
+    if part["shm"] is None:
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=part["shm"])
+    except FileNotFoundError:
+        return
+    shm.unlink()
+    shm.close()
+
+
+def _release_future(fut):
+    if not fut.cancelled() and fut.exception() is None:
+        _release_part(fut.result())
+
+
+def _discard_chunks(parts, futures):
+    """
+    Libera los segmentos de los trozos ya recogidos y cancela los pendientes;
+    los que ya están corriendo liberan su segmento al terminar.
+    """
+    for part in parts:
+        _release_part(part)
+    for fut in futures:
+        if not fut.cancel():
+            fut.add_done_callback(_release_future)
+
+
+def _map_chunks(tasks, workers):
+    """
+    Parsea los trozos en el pool. Si el pool está roto (un proceso murió, p. ej.
+    por el OOM killer) se descarta para que el próximo archivo use uno nuevo y
+    los trozos se parsean en este proceso: el resultado es el mismo.
+
+    Si un trozo falla (MemoryError, error de parseo) se liberan los segmentos
+    de los demás antes de propagar el error: si no, quedarían en /dev/shm.
+    """
+    try:
+        futures = [_get_pool(workers).submit(_parse_chunk, task) for task in tasks]
+    except BrokenProcessPool:
+        futures = []
+
+    parts, broken = [], not futures
+    pending = list(futures)
+    try:
+        while pending:
+            fut = pending[0]
+            try:
+                parts.append(fut.result())
+            except BrokenProcessPool:
+                broken = True
+            pending.pop(0)
+    except BaseException:
+        _discard_chunks(parts, pending[1:])
+        raise
+    if not broken:
+        return parts
+
+    _discard_chunks(parts, [])
+    _reset_pool()
+    print("[WARNING] Pool de parseo en paralelo roto; se recrea y este archivo se parsea en serie")
+    parts = []
+    try:
+        for task in tasks:
+            parts.append(_parse_chunk(task))
+    except BaseException:
+        _discard_chunks(parts, [])
+        raise
+    return parts
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+
+
+# -------------------------
+# Memoria compartida
+# -------------------------
+def _shm_from_bytes(data):
+    """Copia `data` a un segmento de memoria compartida nuevo."""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    return shm
+
+
+def _shm_arrays(shm, runs):
+    """Vistas (n_lineas, x, y) sobre el segmento con las rachas de un trozo."""
+    out = []
+    for n, offset, length in runs:
+        xy = np.ndarray((2, length), dtype=np.float64, buffer=shm.buf, offset=offset)
+        out.append((n, xy[0], xy[1]))
+    return out
+
+
+# -------------------------
+# Localización de la sección de datos
+# -------------------------
+def find_data_offset(buf):
+    """
+    Retorna el offset (en bytes) de la primera línea después de END, o None
+    si el archivo no tiene línea END. Misma regla que _read_post_end_lines.
+    """
+    pos, n = 0, len(buf)
+    while pos < n:
+        nl = buf.find(b'\n', pos)
+        end = n if nl < 0 else nl
+        if buf[pos:end].decode('latin-1').strip().upper() == "END":
+            return n if nl < 0 else nl + 1
+        if nl < 0:
+            break
+        pos = nl + 1
+    return None
+
+
+def _chunk_bounds(buf, start, n_chunks):
+    """Divide buf[start:] en hasta n_chunks rangos que terminan en salto de línea."""
+    n = len(buf)
+    size = max(1, (n - start) // max(1, n_chunks))
+    bounds = []
+    a = start
+    while a < n:
+        b = min(n, a + size)
+        if b < n:
+            nl = buf.find(b'\n', b)
+            b = n if nl < 0 else nl + 1
+        bounds.append((a, b))
+        a = b
+    return bounds
+
+
+# -------------------------
+# Trabajo de cada proceso
+# -------------------------
+def _parse_chunk(args):
+    """
+    Clasifica y parsea el trozo buf[a:b] del archivo en memoria compartida.
+
+    Retorna un diccionario con:
+        has_lines:      si el trozo tiene alguna línea útil (no vacía, sin comillas)
+        first_numeric:  si la primera línea útil es numérica
+        last_numeric:   si la última línea útil es numérica
+        shm:            nombre del segmento con los arrays parseados (o None)
+        runs:           lista de (n_lineas, offset, largo) por cada racha de líneas
+                        numéricas; x e y (float64) van seguidos en el segmento desde offset
+    """
+    shm_name, a, b, detector = args
+    src = shared_memory.SharedMemory(name=shm_name)
+    try:
+        text = bytes(src.buf[a:b]).decode('latin-1', errors='ignore')
+    finally:
+        src.close()
+
+    runs = []
+    current = []
+    first_numeric = None
+    last_numeric = False
+    has_lines = False
+
+    # Trozo uniforme (todas las líneas numéricas con los mismos campos): una sola racha
+    useful = [line.strip() for line in text.split('\n')]
+    useful = [line for line in useful if line and not line.startswith('"')]
+    uniform = parse_uniform_lines(useful, detector)
+    if uniform is not None:
+        runs.append((len(useful), uniform[0], uniform[1]))
+        return _pack_chunk(True, True, True, runs)
+
+    def close_run(lines, edge):
+        # Las rachas de los bordes se parsean siempre: pueden completarse con
+        # el trozo vecino y llegar a 3 líneas
+        if len(lines) >= 3 or edge:
+            x, y = _xy_arrays_from_block(lines, detector)
+        else:
+            x = y = np.empty(0, dtype=np.float64)
+        runs.append((len(lines), x, y))
+
+    for stripped in useful:
+        has_lines = True
+        numeric = _is_numeric_line(stripped)
+        if first_numeric is None:
+            first_numeric = numeric
+        if numeric:
+            current.append(stripped)
+        elif current:
+            close_run(current, edge=len(runs) == 0 and first_numeric)
+            current = []
+        last_numeric = numeric
+
+    if current:
+        close_run(current, edge=True)
+
+    return _pack_chunk(has_lines, bool(first_numeric), last_numeric, runs)
+
+
+def _pack_chunk(has_lines, first_numeric, last_numeric, runs):
+    """Escribe las rachas de un trozo en un segmento propio (lo libera el proceso principal)."""
+    total = sum(len(x) for _, x, _ in runs)
+    shm_name = None
+    layout = []
+    if total:
+        out = shared_memory.SharedMemory(create=True, size=16 * total)
+        offset = 0
+        for n, x, y in runs:
+            dst = np.ndarray((2, len(x)), dtype=np.float64, buffer=out.buf, offset=offset)
+            dst[0], dst[1] = x, y
+            del dst
+            layout.append((n, offset, len(x)))
+            offset += 16 * len(x)
+        shm_name = out.name
+        out.close()
+    else:
+        layout = [(n, 0, 0) for n, _, _ in runs]
+
+    return {
+        "has_lines": has_lines,
+        "first_numeric": first_numeric,
+        "last_numeric": last_numeric,
+        "shm": shm_name,
+        "runs": layout,
+    }
+
+
+# -------------------------
+# Unión de resultados
+# -------------------------
+def _stitch(parts):
+    """
+    Une las rachas que cruzan bordes de trozo y retorna la lista de bloques
+    (n_lineas, [x...], [y...]) en orden de aparición.
+    """
+    blocks = []
+    open_block = None  # racha que llega al final del trozo anterior
+
+    for part in parts:
+        if not part["has_lines"]:
+            # Trozo sin líneas útiles: transparente (las líneas vacías no cortan bloques)
+            continue
+        runs = list(part["runs"])
+
+        if part["first_numeric"] and open_block is not None:
+            n, x, y = runs.pop(0)
+            open_block = (open_block[0] + n, open_block[1] + [x], open_block[2] + [y])
+            if not runs and part["last_numeric"]:
+                # Todo el trozo es una sola racha: sigue abierta
+                continue
+            blocks.append(open_block)
+            open_block = None
+        elif open_block is not None:
+            blocks.append(open_block)
+            open_block = None
+
+        if part["last_numeric"] and runs:
+            n, x, y = runs.pop()
+            open_block = (n, [x], [y])
+
+        for n, x, y in runs:
+            blocks.append((n, [x], [y]))
+
+    if open_block is not None:
+        blocks.append(open_block)
+
+    return blocks
+
+
+def best_xy_parallel(buf, detector="RTOF", workers=None, n_chunks=None):
+    """
+    Equivalente paralelo de la selección del mejor bloque en process_tab_arrays.
+
+    Args:
+        buf: bytes con el archivo .tab completo
+        detector: Tipo de detector ("RTOF" o "DFMS")
+        workers: Número de procesos (default: PARSE_WORKERS o nº de CPUs)
+        n_chunks: Número de trozos (default: 4 por proceso)
+
+    Returns:
+        Tupla (x, y) en float64 del bloque con más puntos válidos
+    """
+    workers = int(workers or PARSE_WORKERS or os.cpu_count() or 1)
+    n_chunks = int(n_chunks or workers * 4)
+
+    start = find_data_offset(buf)
+    if start is None or start >= len(buf):
+        raise ValueError("No se encontraron datos después de la línea END")
+
+    src = _shm_from_bytes(buf)
+    segments = []
+    try:
+        tasks = [(src.name, a, b, detector) for a, b in _chunk_bounds(buf, start, n_chunks)]
+        parts = _map_chunks(tasks, workers)
+
+        empty = np.empty(0, dtype=np.float64)
+        for part in parts:
+            if part["shm"] is None:
+                part["runs"] = [(n, empty, empty) for n, _, _ in part["runs"]]
+                continue
+            shm = shared_memory.SharedMemory(name=part["shm"])
+            segments.append(shm)
+            part["runs"] = _shm_arrays(shm, part["runs"])
+
+        if not any(p["has_lines"] for p in parts):
+            raise ValueError("No se encontraron datos después de la línea END")
+
+        blocks = [b for b in _stitch(parts) if b[0] >= 3]
+        if not blocks:
+            raise ValueError("No se encontraron bloques numéricos válidos en el archivo")
+
+        # Primer bloque con más puntos (mismo desempate que la ruta serial)
+        _, best_xs, best_ys = max(blocks, key=lambda block: sum(len(x) for x in block[1]))
+
+        # concatenate siempre copia: el resultado no depende de los segmentos
+        best_x = np.concatenate(best_xs)
+        best_y = np.concatenate(best_ys)
+        # Soltar las vistas antes de cerrar los segmentos
+        del parts, blocks, best_xs, best_ys
+    finally:
+        for shm in segments + [src]:
+            shm.unlink()
+            try:
+                shm.close()
+            except BufferError:
+                # Quedan vistas vivas (p. ej. por una excepción): el mapeo se
+                # libera cuando se recolecten
+                pass
+
+    return best_x, best_y
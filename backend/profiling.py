@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Perfilado por muestreo de peticiones individuales (sólo administradores).
+
+Si PROFILING_TOKEN está configurado, una petición que envíe la cabecera
+`X-Profile: <token>` se ejecuta con un muestreador
+que lee la pila del hilo del event loop cada PROFILE_INTERVAL_MS. Al terminar
+se guarda el perfil en PROFILE_DIR en formato speedscope (.speedscope.json,
+se abre en https://www.speedscope.app) y como pilas colapsadas
+(.collapsed.txt, para flamegraph.pl), y la respuesta lleva la cabecera
+`X-Profile-Id`. Los perfiles se descargan con GET /profiles/{id} y la misma
+cabecera. El token sólo se acepta en la cabecera: en la query string acabaría
+en los logs de acceso y de los proxies.
+
+Sin PROFILING_TOKEN el middleware no se registra, así que no hay ningún coste.
+El muestreador ve todo lo que corre en el hilo del event loop (también otras
+peticiones concurrentes del mismo worker), pero no los procesos del parseo
+en paralelo.
+
+Variables de entorno:
+    PROFILING_TOKEN:      token de administrador (sin él el perfilado está desactivado)
+    PROFILE_DIR:          carpeta de los perfiles (default: <tmp>/rosetta_profiles)
+    PROFILE_INTERVAL_MS:  intervalo de muestreo en ms (default: 5)
+    PROFILE_KEEP:         perfiles que se conservan; al guardar uno se borran
+                          los más antiguos (default: 50)
+"""
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from env_config import env_float, env_int
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "").strip()
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR") or Path(tempfile.gettempdir()) / "rosetta_profiles")
+PROFILE_INTERVAL = max(0.5, env_float("PROFILE_INTERVAL_MS", 5)) / 1000.0
+PROFILE_KEEP = max(1, env_int("PROFILE_KEEP", 50))
+
+PROFILE_FORMATS = {
+    "speedscope": (".speedscope.json", "application/json"),
+    "collapsed": (".collapsed.txt", "text/plain"),
+}
+
+
+def profiling_enabled():
+    return bool(PROFILING_TOKEN)
+
+
+def is_admin_token(token):
+    """
+    Compara el token recibido con PROFILING_TOKEN (en tiempo constante).
+    Se comparan los bytes UTF-8: compare_digest lanza TypeError con str no ASCII.
+    """
+    if not PROFILING_TOKEN or not token:
+        return False
+    return hmac.compare_digest(str(token).encode("utf-8"), PROFILING_TOKEN.encode("utf-8"))
+
+
+def profiling_requested(request):
+    """Indica si la petición pide perfilado con un token de administrador válido."""
+    return is_admin_token(request.headers.get("x-profile"))
+
+
+def profile_path(profile_id, fmt="speedscope"):
+    """Ruta de un perfil guardado, o None si el id o el formato no son válidos."""
+    if fmt not in PROFILE_FORMATS or not profile_id.isalnum():
+        return None
+    return PROFILE_DIR / f"{profile_id}{PROFILE_FORMATS[fmt][0]}"
+
+
+def prune_profiles(keep=None):
+    """
+    Borra los perfiles más antiguos de PROFILE_DIR y deja los `keep` más
+    recientes (PROFILE_KEEP por defecto). Retorna cuántos perfiles se borraron.
+    """
+    keep = PROFILE_KEEP if keep is None else keep
+    profiles = {}
+    for suffix, _ in PROFILE_FORMATS.values():
+        for path in PROFILE_DIR.glob(f"*{suffix}"):
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue  # otro worker lo acaba de borrar
+            profile_id = path.name[:-len(suffix)]
+            profiles.setdefault(profile_id, []).append((mtime, path))
+    if len(profiles) <= keep:
+        return 0
+    by_age = sorted(profiles.values(), key=lambda files: max(m for m, _ in files))
+    old = by_age[:len(profiles) - keep]
+    for files in old:
+        for _, path in files:
+            path.unlink(missing_ok=True)
+    return len(old)
+
+
+class SamplingProfiler:
+    """
+    Muestrea la pila de un hilo desde un hilo auxiliar. Cada muestra pesa el
+    tiempo real transcurrido desde la anterior (el GIL puede retrasarla).
+    """
+
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or PROFILE_INTERVAL
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._t0
+        return self
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += now - last
+            self.samples += 1
+            last = now
+
+    # -------------------------
+    # Formatos de salida
+    # -------------------------
+    @staticmethod
+    def _frame_name(frame):
+        name, filename, line = frame
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def to_collapsed(self):
+        """Pilas colapsadas ("a;b;c peso_en_microsegundos" por línea)."""
+        lines = []
+        for stack, seconds in self.stacks.most_common():
+            lines.append(";".join(self._frame_name(f) for f in stack) + f" {int(seconds * 1e6)}")
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self, name="request"):
+        """Perfil 'sampled' en el formato de archivo de speedscope."""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, seconds in self.stacks.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(seconds * 1000.0)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "rosetta-profiling",
+        }
+
+    def hotspots(self, top=10):
+        """Funciones con más tiempo propio (hoja de la pila) como [(nombre, segundos)]."""
+        self_time = Counter()
+        for stack, seconds in self.stacks.items():
+            if stack:
+                self_time[self._frame_name(stack[-1])] += seconds
+        return self_time.most_common(top)
+
+    def save(self, name="request"):
+        """
+        Guarda el perfil en PROFILE_DIR en ambos formatos, borra los que pasan
+        de PROFILE_KEEP y retorna su id.
+        """
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profile_id = uuid.uuid4().hex
+        with open(profile_path(profile_id, "speedscope"), "w", encoding="utf-8") as f:
+            json.dump(self.to_speedscope(name), f)
+        with open(profile_path(profile_id, "collapsed"), "w", encoding="utf-8") as f:
+            f.write(self.to_collapsed())
+        try:
+            prune_profiles()
+        except OSError as e:
+            print(f"[WARNING] No se pudieron borrar perfiles antiguos: {e}")
+        return profile_id
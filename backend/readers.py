@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de lectores rápidos por formato para la sección de datos de un .tab.
+
+El formato se detecta con el label y una muestra de las primeras líneas de
+datos (sniff_format):
+    fixed_width: el label define las columnas (bloques OBJECT = COLUMN o
+                 COLUMN = {...}, con START_BYTE y BYTES)
+    csv:         las líneas de datos están separadas por comas (p. ej. DFMS)
+    whitespace:  las líneas de datos están separadas por espacios (p. ej. RTOF)
+
+Cada lector convierte la sección completa en bloque cuando es uniforme (todas
+las líneas con el mismo número de campos numéricos), sin clasificar línea a
+línea con _is_numeric_line. Si la sección no es uniforme (bloques espurios,
+filas cortas, texto) el lector retorna None y se usa la ruta genérica de
+bloques numéricos. Para los formatos csv y whitespace el resultado es idéntico
+al de la ruta genérica.
+
+Un .tab con ^STRUCTURE apunta a un .FMT externo que no se sube con el archivo,
+así que sólo se usa fixed_width cuando las columnas vienen en el propio label.
+"""
+import re
+from io import BytesIO
+from operator import methodcaller
+
+import numpy as np
+
+from rosetta_pipeline import DETECTOR_COLS, parse_column_objects_from_text, parse_fmt_columns_from_text
+
+# Líneas de datos que se miran para detectar el formato
+SNIFF_LINES = 64
+
+# Caracteres posibles en una sección puramente numérica
+_NON_NUMERIC = re.compile(r'[^0-9eEdD+\-.,\s]')
+
+_READERS = {}
+
+
+def register_reader(fmt):
+    """Registra `fn(section, meta, detector) -> (x, y) | None` para un formato."""
+    def decorator(fn):
+        _READERS[fmt] = fn
+        return fn
+    return decorator
+
+
+def available_formats():
+    return list(_READERS)
+
+
+class DataSection:
+    """Sección de datos (después de END) de un .tab en memoria."""
+
+    def __init__(self, file_stream, lines):
+        self.file_stream = file_stream
+        # Líneas sin espacios en los bordes, sin vacías ni comentarios (_read_post_end_lines)
+        self.lines = lines
+        self._raw_lines = None
+
+    @property
+    def raw_lines(self):
+        """Líneas sin recortar (para cortar columnas por posición)."""
+        if self._raw_lines is None:
+            self.file_stream.seek(0)
+            if isinstance(self.file_stream, BytesIO):
+                content = self.file_stream.read().decode('latin-1', errors='ignore')
+            else:
+                content = self.file_stream.read()
+            raw, found_end = [], False
+            for line in content.split('\n'):
+                stripped = line.strip()
+                if found_end:
+                    if stripped and not stripped.startswith('"'):
+                        raw.append(line.rstrip('\r'))
+                elif stripped.upper() == "END":
+                    found_end = True
+            self._raw_lines = raw
+        return self._raw_lines
+
+
+def _label_columns(meta):
+    """Columnas definidas en el propio label (None si no hay o están incompletas)."""
+    header = meta.get('__HEADER', '')
+    cols = parse_column_objects_from_text(header) or parse_fmt_columns_from_text(header)
+    if not cols or any(c['bytes'] <= 0 for c in cols):
+        return None
+    return cols
+
+
+def sniff_format(meta, sample_lines):
+    """
+    Detecta el formato de la sección de datos ("fixed_width", "csv" o
+    "whitespace") a partir del label y de una muestra de líneas de datos.
+    """
+    if _label_columns(meta):
+        return "fixed_width"
+    sample = sample_lines[:SNIFF_LINES]
+    if sample and sum(',' in line for line in sample) * 2 > len(sample):
+        return "csv"
+    return "whitespace"
+
+
+def _xy_columns(n_fields, detector):
+    """Índices (x, y) para líneas con n_fields campos (misma regla que _xy_arrays_from_block)."""
+    ix_x, ix_y = DETECTOR_COLS.get(detector.upper(), (1, 2))
+    if n_fields > max(ix_x, ix_y):
+        return ix_x, ix_y
+    return 0, 1
+
+
+def _finite_xy(x, y):
+    ok = np.isfinite(x) & np.isfinite(y)
+    if not ok.all():
+        x, y = x[ok], y[ok]
+    return np.ascontiguousarray(x), np.ascontiguousarray(y)
+
+
+def parse_uniform_lines(lines, detector="RTOF"):
+    """
+    Convierte en bloque líneas numéricas uniformes (mismo separador y mismo
+    número de campos, todos numéricos). Retorna (x, y) o None si alguna línea
+    no cumple, en cuyo caso hay que usar la ruta genérica.
+
+    Con al menos 3 campos numéricos por línea, todas las líneas son numéricas
+    para _is_numeric_line y forman un único bloque, así que el resultado es
+    el mismo que _xy_arrays_from_block(lines, detector).
+    """
+    if len(lines) < 3:
+        return None
+    if any(_NON_NUMERIC.search(line) for line in (lines[0], lines[-1])):
+        return None
+    text = '\n'.join(lines)
+    if _NON_NUMERIC.search(text):
+        return None
+
+    if ',' in lines[0]:
+        counts = set(map(methodcaller('count', ','), lines))
+        if len(counts) != 1:
+            return None
+        n_fields = counts.pop() + 1
+        tokens = text.replace('\n', ',').split(',')
+    elif ',' in text:
+        return None
+    else:
+        counts = set(map(len, map(str.split, lines)))
+        if len(counts) != 1:
+            return None
+        n_fields = counts.pop()
+        tokens = text.split()
+
+    if n_fields < 3:
+        return None
+    if 'D' in text or 'd' in text:
+        # Exponente Fortran (1.0D+02), como en la ruta genérica
+        tokens = [t.replace("D", "E").replace("d", "e") for t in tokens]
+
+    try:
+        # float() como la ruta genérica (mismo redondeo); todos los campos
+        # tienen que ser números para que cada línea cuente como numérica
+        values = np.fromiter(
+            map(float, tokens), dtype=np.float64, count=len(tokens)
+        ).reshape(len(lines), n_fields)
+    except ValueError:
+        return None
+
+    ix_x, ix_y = _xy_columns(n_fields, detector)
+    return _finite_xy(values[:, ix_x].copy(), values[:, ix_y].copy())
+
+
+@register_reader("whitespace")
+def _read_whitespace(section, meta, detector):
+    return parse_uniform_lines(section.lines, detector)
+
+
+@register_reader("csv")
+def _read_csv(section, meta, detector):
+    return parse_uniform_lines(section.lines, detector)
+
+
+@register_reader("fixed_width")
+def _read_fixed_width(section, meta, detector):
+    """
+    Corta cada columna por START_BYTE/BYTES del label. Las columnas (x, y) se
+    eligen por posición con DETECTOR_COLS, igual que los campos de la ruta
+    genérica; funciona aunque dos columnas queden pegadas sin separador.
+    """
+    cols = _label_columns(meta)
+    lines = section.raw_lines
+    if not cols or len(lines) < 3:
+        return None
+
+    ix_x, ix_y = _xy_columns(len(cols), detector)
+    spans = []
+    for ix in (ix_x, ix_y):
+        start = cols[ix]['start_byte'] - 1
+        spans.append((start, start + cols[ix]['bytes']))
+    min_len = max(end for _, end in spans)
+    if any(len(line) < min_len for line in lines):
+        return None
+
+    out = []
+    for start, end in spans:
+        try:
+            out.append(np.fromiter(
+                map(float, (line[start:end].replace("D", "E").replace("d", "e") for line in lines)),
+                dtype=np.float64, count=len(lines)
+            ))
+        except ValueError:
+            return None
+    return _finite_xy(*out)
+
+
+def read_fast_xy(file_stream, lines, meta, detector="RTOF"):
+    """
+    Intenta leer la sección de datos con el lector rápido de su formato.
+
+    Args:
+        file_stream: stream del .tab completo (para los lectores por posición)
+        lines: líneas de datos de _read_post_end_lines
+        meta: metadatos del label
+        detector: detector resuelto con resolve_detector
+
+    Returns:
+        Tupla (formato, x, y), o None si la sección requiere la ruta genérica
+    """
+    section = DataSection(file_stream, lines)
+    fmt = sniff_format(meta, lines)
+    reader = _READERS.get(fmt)
+    result = reader(section, meta, detector) if reader else None
+    if result is None and fmt == "fixed_width":
+        # Columnas del label que no cuadran con las filas: probar por separadores
+        fmt = "csv" if sniff_format({}, lines) == "csv" else "whitespace"
+        result = _READERS[fmt](section, meta, detector)
+    if result is None or len(result[0]) == 0:
+        return None
+    return (fmt,) + result
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Referencia independiente de los niveles con línea base ("baseline" y
+"baseline_als") para validate_engines.py.
+
+El pipeline original no tenía estos niveles, así que no hay versión congelada
+con la que comparar. Esta referencia parte de la lectura congelada de
+reference_pipeline.py y calcula la línea base de la forma más directa posible,
+sin compartir código con baseline.py ni con _robust_center:
+    rolling: una mediana por ventana con un bucle de Python (sin
+             sliding_window_view ni lotes) e interpolación lineal.
+    als:     el sistema (W + lambda DᵀD) z = W v se arma denso con
+             np.diff(np.eye(m), 2) y se resuelve con np.linalg.solve, en lugar
+             de la factorización pentadiagonal. El resultado coincide con el del
+             pipeline salvo por el redondeo (ver ALS_ATOL / ALS_RTOL).
+
+Los parámetros (ventana, lambda, p, nodos) se leen de baseline.py para usar
+la misma configuración.
+"""
+import numpy as np
+import pandas as pd
+
+import baseline as baseline_config
+import reference_pipeline as ref
+
+# Tolerancia de la referencia ALS frente al pipeline: el sistema está mal
+# condicionado (lambda = 1e4) y el solve denso y el LDLᵀ pentadiagonal
+# difieren en ~1e-8 cps en el corpus sintético
+ALS_ATOL = 1e-6
+ALS_RTOL = 1e-7
+
+# Umbrales por defecto de alto grado (los de los niveles con línea base)
+_HIGH_DEFAULTS = {"RTOF": (10, 5), "DFMS": (8, 1e4)}
+
+
+def _medians(y, window, step):
+    """Centros y medianas de y[s:s+window] con s = 0, step, ... y la última ventana al final."""
+    n = len(y)
+    window = max(1, min(int(window), n))
+    starts = list(range(0, n - window + 1, max(1, int(step))))
+    if starts[-1] != n - window:
+        starts.append(n - window)
+    centers = np.array([s + (window - 1) / 2.0 for s in starts])
+    medians = np.array([np.median(y[s:s + window]) for s in starts])
+    return centers, medians
+
+
+def rolling_median(y, window):
+    n = len(y)
+    if window >= n:
+        return np.full(n, np.median(y))
+    centers, medians = _medians(y, window, window // 2)
+    return np.interp(np.arange(n), centers, medians)
+
+
+def als_baseline(y, lam, p, nodes, n_iter):
+    n = len(y)
+    block = max(1, -(-n // nodes))
+    centers, v = _medians(y, block, block)
+    m = len(v)
+    if m < 3:
+        return np.full(n, np.median(y))
+    D = np.diff(np.eye(m), 2, axis=0)
+    P = lam * (D.T @ D)
+    w = np.ones(m)
+    z = v
+    for _ in range(n_iter):
+        z = np.linalg.solve(np.diag(w) + P, w * v)
+        w_new = np.where(v > z, p, 1.0 - p)
+        if np.array_equal(w_new, w):
+            break
+        w = w_new
+    return np.interp(np.arange(n), centers, z)
+
+
+def process_tab_file(file_stream, filter_level="baseline", **filter_params):
+    """
+    Procesa un .tab con un nivel de línea base. Retorna (x, cps) en float64.
+    """
+    meta = ref.read_label_header_from_stream(file_stream)
+    detector_id = meta.get('DETECTOR_ID', '').upper()
+    detector = "RTOF" if "RTOF" in detector_id else "DFMS" if "DFMS" in detector_id else "RTOF"
+
+    lines_after = ref._read_post_end_lines(file_stream)
+    blocks = ref._slice_numeric_blocks(lines_after) if lines_after else []
+    best_df = pd.DataFrame(columns=["x", "y"])
+    for block in blocks:
+        df_block = ref._xy_from_block(block, detector)
+        if len(df_block) > len(best_df):
+            best_df = df_block
+    if best_df.empty:
+        raise ValueError("No se pudieron extraer datos numéricos válidos")
+
+    head_drop = filter_params.get("head_drop", 10 if detector == "RTOF" else 5)
+    df = best_df.iloc[head_drop:] if len(best_df) > head_drop else best_df
+    df = df[df["x"] > 0]
+    if df.empty:
+        raise ValueError("No quedaron datos válidos después de la limpieza")
+
+    y = df["y"].to_numpy(dtype=np.float64)
+    window = baseline_config.BASELINE_WINDOW
+    if filter_level == "baseline_als":
+        base = als_baseline(y, baseline_config.ALS_LAMBDA, baseline_config.ALS_P,
+                            baseline_config.ALS_NODES, baseline_config.ALS_ITERATIONS)
+    else:
+        base = rolling_median(y, window)
+    cps = y - base
+    mad = rolling_median(np.abs(cps), window) + 1e-12
+
+    key = "rtof" if detector == "RTOF" else "dfms"
+    mad_mult = filter_params.get(f"mad_multiplier_{key}", _HIGH_DEFAULTS[detector][0])
+    cps_thresh = filter_params.get(f"cps_threshold_{key}", _HIGH_DEFAULTS[detector][1])
+    keep = (np.abs(cps) <= mad_mult * mad) & (np.abs(cps) <= cps_thresh)
+    x = df["x"].to_numpy(dtype=np.float64)[keep]
+    if len(x) == 0:
+        raise ValueError("No quedaron datos válidos después de la limpieza")
+    return x, cps[keep]
@@ -6,12 +6,69 @@ Adaptado del código de Colab para funcionar con archivos en memoria
 import re
 import os
 import csv
-import pandas as pd
+import io
 import numpy as np
 from pathlib import Path
 from io import BytesIO, StringIO
 
 
+# Modos de precisión para la columna de intensidad (x siempre es float64)
+PRECISION_DTYPES = {
+    "float64": np.float64,
+    "float32": np.float32,
+}
+
+
+def resolve_precision(precision):
+    """
+    Traduce el nombre de un modo de precisión ("float64" / "float32") al dtype
+    de numpy para cps. Valores desconocidos usan float64.
+    """
+    return PRECISION_DTYPES.get(str(precision or "").strip().lower(), np.float64)
+
+
+# Niveles de filtrado con línea base local (ver baseline.py): usan los umbrales
+# de alto grado, pero centran con la línea base y comparan contra el MAD local
+BASELINE_LEVELS = {
+    "baseline": "rolling",
+    "baseline_als": "als",
+}
+FILTER_LEVELS = ("high", "low") + tuple(BASELINE_LEVELS)
+
+
+def uses_high_thresholds(filter_level):
+    """Indica si el nivel de filtrado usa los umbrales por defecto de alto grado."""
+    level = str(filter_level or "").lower()
+    return level == "high" or level in BASELINE_LEVELS
+
+
+# Columnas (x, y) por detector en las líneas numéricas (índices basados en 0,
+# como DETECTOR_COLS del código de Colab). Otros sensores usan (1, 2).
+# El orden es la prioridad de resolve_detector si el label nombra varios.
+DETECTOR_COLS = {
+    "RTOF": (1, 3),
+    "DFMS": (1, 2),
+    "COPS": (1, 2),
+}
+DEFAULT_DETECTOR = "RTOF"
+
+
+def resolve_detector(meta):
+    """
+    Detector ROSINA del archivo a partir del label: busca RTOF, DFMS o COPS en
+    DETECTOR_ID y, si no aparece, en PRODUCT_ID e INSTRUMENT_ID.
+    Si no se reconoce se usa RTOF (avisando en el log).
+    """
+    for key in ('DETECTOR_ID', 'PRODUCT_ID', 'INSTRUMENT_ID'):
+        value = (meta.get(key) or '').upper()
+        for detector in DETECTOR_COLS:
+            if detector in value:
+                return detector
+    print(f"[WARNING] Detector no reconocido (DETECTOR_ID={meta.get('DETECTOR_ID')!r}), "
+          f"usando {DEFAULT_DETECTOR}")
+    return DEFAULT_DETECTOR
+
+
 # -------------------------
 # Helpers
 # -------------------------
@@ -89,7 +146,28 @@ def read_label_header_from_stream(file_stream):
             break
     
     header = '\n'.join(hdr_lines)
+    return _label_meta_from_header(header)
+
 
+def read_label_header_from_lines(text_stream):
+    """
+    Lee el encabezado PDS3 consumiendo líneas de un stream de texto hasta END
+    (inclusive), sin leer el resto del archivo. El stream queda posicionado
+    al inicio de la sección de datos.
+    Retorna un diccionario con los metadatos.
+    """
+    hdr_lines = []
+    for line in text_stream:
+        hdr_lines.append(line.rstrip('\n'))
+        if line.strip().upper() == 'END':
+            break
+    
+    header = '\n'.join(hdr_lines)
+    return _label_meta_from_header(header)
+
+
+def _label_meta_from_header(header):
+    """Extrae los metadatos del texto del encabezado PDS3."""
     out = {
         'RECORD_BYTES': _to_int(_find_label_value(header, 'RECORD_BYTES')),
         'LABEL_RECORDS': _to_int(_find_label_value(header, 'LABEL_RECORDS')),
@@ -141,14 +219,47 @@ def parse_fmt_columns_from_text(fmt_text):
     return cols
 
 
+_COLUMN_OBJECT = re.compile(
+    r'^\s*OBJECT\s*=\s*COLUMN\b(.*?)^\s*END_OBJECT\b',
+    flags=re.MULTILINE | re.DOTALL | re.IGNORECASE
+)
+
+
+def parse_column_objects_from_text(fmt_text):
+    """
+    Parsea columnas en la sintaxis PDS3 de objetos:
+
+        OBJECT = COLUMN
+          NAME = ...
+          START_BYTE = ...
+          BYTES = ...
+        END_OBJECT = COLUMN
+
+    Retorna [] si falta START_BYTE/BYTES en alguna columna o si el label usa
+    CONTAINER (ahí START_BYTE es relativo al contenedor y no a la fila).
+    """
+    if re.search(r'^\s*OBJECT\s*=\s*CONTAINER\b', fmt_text, flags=re.MULTILINE | re.IGNORECASE):
+        return []
+    cols = []
+    for m in _COLUMN_OBJECT.finditer(fmt_text):
+        blk = m.group(1)
+        start = _to_int(_find_label_value(blk, 'START_BYTE'))
+        width = _to_int(_find_label_value(blk, 'BYTES'))
+        if start is None or width is None:
+            return []
+        name = (_find_label_value(blk, 'NAME') or '').strip().strip('"')
+        cols.append({'name': name, 'start_byte': start, 'bytes': width})
+    return cols
+
+
 def parse_fmt_columns_from_header(header_dict):
     """
     Intenta parsear columnas desde el header inline.
     Si no encuentra, usa fallback genérico.
     """
-    # 1) Inline (algunos productos traen COLUMN={...} en el label)
+    # 1) Inline (COLUMN={...} o bloques OBJECT = COLUMN en el label)
     header = header_dict.get('__HEADER', '')
-    cols = parse_fmt_columns_from_text(header)
+    cols = parse_fmt_columns_from_text(header) or parse_column_objects_from_text(header)
     if cols:
         return cols
 
@@ -224,6 +335,7 @@ def read_fixed_table_stream(file_stream, fmt_cols, record_bytes, start_record, r
         if read_max is not None and n >= read_max:
             break
     
+    import pandas as pd
     return pd.DataFrame(data)
 
 
@@ -288,9 +400,10 @@ def _slice_numeric_blocks(lines):
             blocks.append(lines[start:i])
     return blocks
 
-def _xy_from_block(block_lines, detector="RTOF"):
+def _xy_arrays_from_block(block_lines, detector="RTOF", dtype=np.float64):
     """
-    Extrae x e y de un bloque de líneas numéricas.
+    Versión NumPy de _xy_from_block: retorna (x, y) como arrays contiguos
+    de tipo `dtype`, sin construir DataFrames.
     Basado en DETECTOR_COLS del código de Colab: {"DFMS": (1, 2), "RTOF": (1, 3)}
     En el código de Colab, estos valores se usan directamente como índices (basados en 0),
     así que RTOF usa índices 0 y 2, DFMS usa 0 y 1.
@@ -302,8 +415,7 @@ def _xy_from_block(block_lines, detector="RTOF"):
     # Si DETECTOR_COLS = (1, 2), entonces parts[1] accede al segundo elemento (índice 1)
     # Esto significa que DETECTOR_COLS usa índices basados en 0 directamente
     # Así que (1, 2) significa índices 1 y 2, (1, 3) significa índices 1 y 3
-    detector_cols = {"DFMS": (1, 2), "RTOF": (1, 3)}
-    ix_x, ix_y = detector_cols.get(det, (1, 2))
+    ix_x, ix_y = DETECTOR_COLS.get(det, (1, 2))
     
     for s in block_lines:
         parts = _split_numbers(s)
@@ -324,12 +436,30 @@ def _xy_from_block(block_lines, detector="RTOF"):
             except:
                 continue
     
-    if not xs:
+    x = np.asarray(xs, dtype=np.float64)
+    y = np.asarray(ys, dtype=np.float64)
+    
+    # Equivalente a .replace([inf, -inf], nan).dropna()
+    ok = np.isfinite(x) & np.isfinite(y)
+    if not ok.all():
+        x, y = x[ok], y[ok]
+    
+    return np.ascontiguousarray(x, dtype=dtype), np.ascontiguousarray(y, dtype=dtype)
+
+def _xy_from_block(block_lines, detector="RTOF"):
+    """
+    Extrae x e y de un bloque de líneas numéricas como DataFrame.
+    Wrapper sobre _xy_arrays_from_block (se mantiene por compatibilidad).
+    """
+    import pandas as pd
+    
+    x, y = _xy_arrays_from_block(block_lines, detector)
+    if len(x) == 0:
         return pd.DataFrame(columns=["x", "y"])
     
-    df = pd.DataFrame({"x": xs, "y": ys})
+    df = pd.DataFrame({"x": x, "y": y})
     df["scan_i"] = np.arange(len(df), dtype=int)
-    return df.replace([np.inf, -np.inf], np.nan).dropna()
+    return df
 
 def _read_post_end_lines(file_stream):
     """Lee líneas después de END, similar a Colab"""
@@ -351,14 +481,283 @@ def _read_post_end_lines(file_stream):
     
     return lines_after
 
-def _robust_clean_simple(df, detector="RTOF", filter_level="high", **filter_params):
+# -------------------------
+# Lectura en streaming (archivos comprimidos)
+# -------------------------
+# Extensiones aceptadas y su compresión
+TAB_EXTENSIONS = {
+    '.tab': None,
+    '.tab.gz': 'gzip',
+    '.tab.bz2': 'bz2',
+    '.tab.zst': 'zstd',
+    '.zip': 'zip',
+}
+
+# Líneas que se acumulan antes de convertirlas a arrays
+_STREAM_BATCH_LINES = 8192
+
+
+def tab_compression_from_filename(filename):
+    """
+    Retorna el tipo de compresión según la extensión (None para .tab plano).
+    Lanza ValueError si la extensión no es soportada.
+    """
+    name = (filename or '').lower()
+    # Las extensiones compuestas primero (.tab.gz antes que .tab)
+    for ext in sorted(TAB_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(ext):
+            return TAB_EXTENSIONS[ext]
+    raise ValueError("El archivo debe ser .tab, .tab.gz, .tab.bz2, .tab.zst o .zip")
+
+
+class _DecompressedReader(io.RawIOBase):
+    """
+    Envuelve el stream de un descompresor y traduce sus errores (archivo
+    corrupto o truncado) a ValueError. Los descompresores fallan al leer, no
+    al abrir, así que el error puede aparecer en el encabezado o en los datos.
     """
-    Limpieza robusta simplificada basada en el código de Colab.
+
+    def __init__(self, raw, errors):
+        self._raw = raw
+        self._errors = errors
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            return self._raw.readinto(b)
+        except self._errors as e:
+            raise ValueError(f"El archivo comprimido está dañado o incompleto: {e}") from e
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+class _ZstdReader(io.RawIOBase):
+    """
+    Descompresor de .zst por frames con decompressobj. A diferencia de
+    stream_reader, un frame truncado lanza ZstdError en vez de terminar como
+    si el archivo estuviera completo.
+    """
+
+    def __init__(self, fileobj, zstandard, chunk_size=1 << 17):
+        self._src = fileobj
+        self._zstandard = zstandard
+        self._dctx = zstandard.ZstdDecompressor()
+        self._obj = self._dctx.decompressobj()
+        self._chunk_size = chunk_size
+        self._pending = b''
+        self._in_frame = False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        while not self._pending:
+            chunk = self._src.read(self._chunk_size)
+            if not chunk:
+                if self._in_frame:
+                    raise self._zstandard.ZstdError("el archivo .zst está truncado")
+                return
+            out = [self._obj.decompress(chunk)]
+            self._in_frame = True
+            while self._obj.eof:
+                # Frames concatenados: seguir con lo que sobró del anterior
+                rest = self._obj.unused_data
+                self._obj = self._dctx.decompressobj()
+                self._in_frame = bool(rest)
+                if not rest:
+                    break
+                out.append(self._obj.decompress(rest))
+            self._pending = b''.join(out)
+
+    def readinto(self, b):
+        self._fill()
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def open_tab_stream(filename, fileobj):
+    """
+    Abre un stream binario que descomprime `fileobj` al vuelo según la
+    extensión de `filename`. Para .zip se abre el primer miembro .tab.
+    Un archivo comprimido dañado lanza ValueError al leerlo.
+    """
+    import zlib
+    compression = tab_compression_from_filename(filename)
+    errors = (OSError, EOFError, zlib.error)
+    
+    if compression is None:
+        return fileobj
+    if compression == 'gzip':
+        import gzip
+        raw = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    elif compression == 'bz2':
+        import bz2
+        raw = bz2.BZ2File(fileobj, mode='rb')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("El soporte para .tab.zst requiere el paquete 'zstandard'")
+        raw = _ZstdReader(fileobj, zstandard)
+        errors += (zstandard.ZstdError,)
+    elif compression == 'zip':
+        import zipfile
+        try:
+            zf = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise ValueError("El archivo .zip no es válido")
+        members = [n for n in zf.namelist() if n.lower().endswith('.tab')]
+        if not members:
+            raise ValueError("El archivo .zip no contiene ningún archivo .tab")
+        if len(members) > 1:
+            print(f"[WARNING] El .zip contiene {len(members)} archivos .tab, se procesa sólo {members[0]}")
+        raw = zf.open(members[0])
+        errors += (zipfile.BadZipFile,)
+    else:
+        raise ValueError(f"Compresión no soportada: {compression}")
+    
+    # gzip.BadGzipFile es un OSError
+    return io.BufferedReader(_DecompressedReader(raw, errors), buffer_size=1 << 20)
+
+
+def open_tab_text_stream(filename, fileobj):
+    """
+    Igual que open_tab_stream pero retorna un stream de texto (latin-1) que
+    separa líneas sólo por '\\n', como _read_post_end_lines.
+    """
+    return io.TextIOWrapper(open_tab_stream(filename, fileobj), encoding='latin-1',
+                            errors='ignore', newline='\n')
+
+
+def _best_xy_from_lines(lines, detector="RTOF"):
+    """
+    Versión en streaming de _read_post_end_lines + _slice_numeric_blocks +
+    selección del mejor bloque. Consume `lines` (ya posicionado después de END)
+    una sola vez y sólo mantiene en memoria el mejor bloque y el bloque actual,
+    ya convertidos a arrays. El resultado es idéntico al de la ruta en memoria.
+    
+    Returns:
+        Tupla (x, y) del mejor bloque
+    """
+    best_x = best_y = np.empty(0, dtype=np.float64)
+    n_kept = 0
+    n_blocks = 0
+    
+    # Bloque actual: trozos ya convertidos + líneas pendientes
+    xs, ys, pending, n_block = [], [], [], 0
+    
+    def flush():
+        if pending:
+            x, y = _xy_arrays_from_block(pending, detector)
+            xs.append(x)
+            ys.append(y)
+            pending.clear()
+    
+    def close_block():
+        nonlocal best_x, best_y, n_blocks, xs, ys, n_block
+        if n_block >= 3:
+            flush()
+            n_blocks += 1
+            count = sum(len(x) for x in xs)
+            if count > len(best_x):
+                best_x = np.concatenate(xs) if len(xs) != 1 else xs[0]
+                best_y = np.concatenate(ys) if len(ys) != 1 else ys[0]
+        pending.clear()
+        xs, ys, n_block = [], [], 0
+    
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith('"'):
+            continue
+        n_kept += 1
+        if _is_numeric_line(stripped):
+            pending.append(stripped)
+            n_block += 1
+            if len(pending) >= _STREAM_BATCH_LINES:
+                flush()
+        elif n_block:
+            close_block()
+    close_block()
+    
+    if not n_kept:
+        raise ValueError("No se encontraron datos después de la línea END")
+    if not n_blocks:
+        raise ValueError("No se encontraron bloques numéricos válidos en el archivo")
+    
+    return best_x, best_y
+
+
+def read_tab_xy_lines(text_stream, meta=None):
+    """
+    Lee en streaming el mejor bloque numérico (sin limpieza) de un stream de texto.
+    
+    Returns:
+        Tupla (detector, x, y) con x e y en float64
+    """
+    if meta is None:
+        meta = read_label_header_from_lines(text_stream)
+    detector = resolve_detector(meta)
+    
+    best_x, best_y = _best_xy_from_lines(text_stream, detector)
+    
+    if len(best_x) == 0:
+        raise ValueError("No se pudieron extraer datos numéricos válidos")
+    
+    return detector, best_x, best_y
+
+
+def process_tab_lines(text_stream, filter_level="high", cps_dtype=np.float64, meta=None, calibrate=False,
+                      **filter_params):
+    """
+    Procesa un .tab desde un stream de texto en una sola pasada, sin mantener
+    el archivo completo en memoria (p. ej. open_tab_text_stream sobre un .tab.gz).
     
     Args:
-        df: DataFrame con columnas 'x' e 'y'
+        text_stream: stream de texto del .tab (ver open_tab_text_stream)
+        filter_level: Nivel de filtrado ("high", "low", "baseline" o "baseline_als")
+        cps_dtype: Tipo de las intensidades (ver process_tab_arrays)
+        meta: Metadatos ya leídos con read_label_header_from_lines; si es None
+            se lee el encabezado del stream
+        calibrate: Calibrar la escala de m/z (ver process_tab_arrays)
+        **filter_params: Parámetros opcionales de filtrado (ver process_tab_file)
+    
+    Returns:
+        Tupla (x, cps) de arrays contiguos (x en float64, cps en `cps_dtype`)
+    """
+    if meta is None:
+        meta = read_label_header_from_lines(text_stream)
+    detector, best_x, best_y = read_tab_xy_lines(text_stream, meta=meta)
+    
+    if calibrate:
+        from calibration import calibrate_xy
+        best_x, _ = calibrate_xy(best_x, best_y, meta, detector)
+    
+    x, cps = _robust_clean_arrays(best_x, best_y, detector, filter_level, cps_dtype=cps_dtype, **filter_params)
+    
+    if len(x) == 0:
+        raise ValueError("No quedaron datos válidos después de la limpieza")
+    
+    return x, cps
+
+def _robust_clean_arrays(x, y, detector="RTOF", filter_level="high", cps_dtype=np.float64, **filter_params):
+    """
+    Limpieza robusta simplificada basada en el código de Colab (versión NumPy).
+    
+    Args:
+        x: array con m/z
+        y: array con intensidades
         detector: Tipo de detector ("RTOF" o "DFMS")
-        filter_level: Nivel de filtrado ("high" para alto grado, "low" para bajo grado)
+        filter_level: Nivel de filtrado ("high" para alto grado, "low" para bajo grado,
+            "baseline" / "baseline_als" para alto grado con línea base local)
+        cps_dtype: Tipo con el que se procesan y retornan las intensidades
+            (np.float64 por defecto, o np.float32). x siempre se mantiene en float64.
         **filter_params: Parámetros opcionales de filtrado:
             - head_drop: Número de filas iniciales a descartar (default: 10 para RTOF, 5 para DFMS)
             - mad_multiplier_rtof: Multiplicador MAD para RTOF (default: 10 para alto, 1000 para bajo)
@@ -370,144 +769,358 @@ def _robust_clean_simple(df, detector="RTOF", filter_level="high", **filter_para
     Para DFMS (alto grado): descarta primeras filas, centra cps, filtra outliers estrictos (ajustable).
     
     Para bajo grado: descarta primeras filas y aplica filtros más permisivos (ajustable).
+    
+    Con línea base ("baseline": mediana móvil, "baseline_als": ALS): en lugar de la
+    mediana global resta una línea base local y el umbral MAD usa el MAD local de
+    cada punto. Los umbrales por defecto son los de alto grado.
+    
+    Returns:
+        Tupla (x, cps) de arrays contiguos (x en float64, cps en `cps_dtype`)
     """
-    if df.empty:
-        return df
+    x, cps, mad = _robust_center(x, y, detector, filter_level, cps_dtype, filter_params.get("head_drop"))
+    
+    if mad is None:
+        return x, cps
+    
+    mad_mult, cps_thresh = _threshold_params(detector, filter_level, filter_params)
+    abs_cps = np.abs(cps)
+    keep = (abs_cps <= mad_mult * mad) & (abs_cps <= cps_thresh)
+    return np.ascontiguousarray(x[keep]), np.ascontiguousarray(cps[keep])
+
+def _threshold_params(detector="RTOF", filter_level="high", filter_params=None):
+    """
+    Retorna (mad_multiplier, cps_threshold) para el detector y nivel de filtrado,
+    usando los parámetros personalizados si vienen en `filter_params`.
+    """
+    filter_params = filter_params or {}
+    is_high_filter = uses_high_thresholds(filter_level)
+    if detector.upper() == "RTOF":
+        mad_key, cps_key = "mad_multiplier_rtof", "cps_threshold_rtof"
+        defaults = (10, 5) if is_high_filter else (1000, 500)
+    else:
+        mad_key, cps_key = "mad_multiplier_dfms", "cps_threshold_dfms"
+        defaults = (8, 1e4) if is_high_filter else (800, 1e8)
+    return filter_params.get(mad_key, defaults[0]), filter_params.get(cps_key, defaults[1])
+
+def _robust_center(x, y, detector="RTOF", filter_level="high", cps_dtype=np.float64, head_drop=None):
+    """
+    Primera parte de la limpieza robusta: descarta las primeras filas y x <= 0,
+    centra restando la mediana (o la línea base local) y calcula el MAD. No
+    aplica los umbrales.
+    
+    Returns:
+        Tupla (x, cps, mad) con los puntos candidatos (x en float64, cps en
+        `cps_dtype`). mad es None si no quedan puntos; en los niveles con línea
+        base es un array con el MAD local de cada punto.
+    """
+    # La precisión de m/z importa: x nunca se reduce a float32. Las intensidades
+    # se centran en float64 y sólo cps (ya centrado) pasa a `cps_dtype`: el error
+    # de float32 queda relativo al valor de cps y no al nivel de cuentas crudo
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    
+    def _out(xo, co, mad=None):
+        if mad is not None and np.ndim(mad) == 0:
+            mad = np.dtype(cps_dtype).type(mad)
+        return np.ascontiguousarray(xo, dtype=np.float64), np.ascontiguousarray(co, dtype=cps_dtype), mad
+    
+    if len(x) == 0:
+        return _out(x, y)
     
     det = detector.upper()
-    is_high_filter = filter_level.lower() == "high"
+    level = filter_level.lower()
+    is_high_filter = level == "high"
     
-    # Configurar parámetros según el nivel de filtrado
     # Usar parámetro personalizado o default
-    if "head_drop" in filter_params:
-        head_drop = filter_params["head_drop"]
-    else:
+    if head_drop is None:
         head_drop = 10 if det == "RTOF" else 5
     
     # Descartar primeras filas
-    if len(df) > head_drop:
-        df = df.iloc[head_drop:].copy()
+    if len(x) > head_drop:
+        x, y = x[head_drop:], y[head_drop:]
     
     # Filtrar x > 0 (siempre aplicamos este filtro básico)
-    df = df[df["x"] > 0].copy()
+    keep = x > 0
+    x, y = x[keep], y[keep]
     
-    if df.empty:
-        return df
+    if len(x) == 0:
+        return _out(x, y)
     
-    if is_high_filter:
+    if level in BASELINE_LEVELS:
+        # LÍNEA BASE LOCAL: centrar con la línea base y usar el MAD local como ruido
+        from baseline import estimate_baseline
+        baseline, noise = estimate_baseline(y, BASELINE_LEVELS[level])
+        cps = y - baseline
+        mad = noise.astype(cps_dtype, copy=False) + 1e-12
+    elif is_high_filter:
         # ALTO GRADO: Versión original del código de Colab (sin modificaciones)
-        # Convertir y a float y centrar (restar mediana) - exactamente como en el código original
-        y = df["y"].astype(float)
+        # Centrar (restar mediana) - exactamente como en el código original
         med = np.median(y)
         cps = y - med
-        df["cps"] = cps
         
         # Filtrar outliers usando MAD
         mad = np.median(np.abs(cps - np.median(cps))) + 1e-12
-        
-        if det == "RTOF":
-            # RTOF: usar parámetros personalizados o defaults
-            mad_mult = filter_params.get("mad_multiplier_rtof", 10)
-            cps_thresh = filter_params.get("cps_threshold_rtof", 5)
-            df = df[(df["cps"].abs() <= mad_mult * mad) & (df["cps"].abs() <= cps_thresh)].copy()
-        else:
-            # DFMS: usar parámetros personalizados o defaults
-            mad_mult = filter_params.get("mad_multiplier_dfms", 8)
-            cps_thresh = filter_params.get("cps_threshold_dfms", 1e4)
-            df = df[(df["cps"].abs() <= mad_mult * mad) & (df["cps"].abs() <= cps_thresh)].copy()
     else:
         # BAJO GRADO: Versión mejorada con filtrado mínimo
-        # Convertir y a float y eliminar valores negativos de intensidad original
-        y = df["y"].astype(float)
-        df = df[y >= 0].copy()
-        
-        if df.empty:
-            return df
+        # Eliminar valores negativos de intensidad original
+        keep = y >= 0
+        x, y = x[keep], y[keep]
         
-        # Recalcular y después del filtrado
-        y = df["y"].astype(float)
+        if len(x) == 0:
+            return _out(x, y)
         
         # Centrar (restar mediana)
         med = np.median(y)
         cps = y - med
-        df["cps"] = cps
+        
+        # MAD sobre los cps centrados (antes de descartar cps < 0, como en Colab)
+        mad = np.median(np.abs(cps - np.median(cps))) + 1e-12
         
         # Eliminar valores negativos después del centrado (cps < 0)
-        df = df[df["cps"] >= 0].copy()
+        keep = cps >= 0
+        x, cps = x[keep], cps[keep]
+    
+    return _out(x, cps, mad)
+
+class RefilterIndex:
+    """
+    Estadísticas de limpieza precomputadas para un espectro ya parseado.
+    
+    Guarda los puntos candidatos (tras head_drop y x > 0), la mediana/MAD y el
+    orden de |cps|, así que cambiar mad_multiplier_* / cps_threshold_* sólo
+    requiere un searchsorted del umbral, sin volver a parsear ni ordenar.
+    Con MAD local (niveles con línea base) el umbral MAD se compara punto a
+    punto sobre los candidatos que pasan el umbral de cps.
+    El resultado de apply() es idéntico al de _robust_clean_arrays.
+    """
+    
+    def __init__(self, x, y, detector="RTOF", filter_level="high", cps_dtype=np.float64, head_drop=None):
+        self.detector = detector
+        self.filter_level = filter_level
+        self.x, self.cps, self.mad = _robust_center(x, y, detector, filter_level, cps_dtype, head_drop)
         
-        # Filtrar outliers usando MAD
-        mad = np.median(np.abs(cps - np.median(cps))) + 1e-12
+        abs_cps = np.abs(self.cps)
+        order = np.argsort(abs_cps, kind='stable')
+        self.order = order.astype(np.int32) if len(order) < 2**31 else order
+        self.sorted_abs = abs_cps[order]
+    
+    @property
+    def nbytes(self):
+        return (self.x.nbytes + self.cps.nbytes + self.order.nbytes + self.sorted_abs.nbytes
+                + np.asarray(self.mad).nbytes)
+    
+    def apply(self, **filter_params):
+        """
+        Aplica los umbrales (mad_multiplier_*, cps_threshold_*) en O(log n) + máscara.
+        
+        Returns:
+            Tupla (x, cps) igual a la de _robust_clean_arrays con los mismos parámetros
+        """
+        if self.mad is None:
+            return self.x, self.cps
+        
+        mad_mult, cps_thresh = _threshold_params(self.detector, self.filter_level, filter_params)
+        # Mismo dtype que la comparación de _robust_clean_arrays
+        as_dtype = self.sorted_abs.dtype.type
+        local_mad = np.ndim(self.mad) > 0
+        if local_mad:
+            cutoff = as_dtype(cps_thresh)
+        else:
+            cutoff = min(as_dtype(mad_mult * self.mad), as_dtype(cps_thresh))
+        k = int(np.searchsorted(self.sorted_abs, cutoff, side='right'))
         
-        if det == "RTOF":
-            # RTOF: usar parámetros personalizados o defaults
-            mad_mult = filter_params.get("mad_multiplier_rtof", 1000)
-            cps_thresh = filter_params.get("cps_threshold_rtof", 500)
-            df = df[(df["cps"].abs() <= mad_mult * mad) & (df["cps"].abs() <= cps_thresh)].copy()
+        # Máscara en lugar de ordenar los índices: conserva el orden original de x
+        keep = np.zeros(len(self.x), dtype=bool)
+        if local_mad:
+            candidates = self.order[:k]
+            keep[candidates[self.sorted_abs[:k] <= mad_mult * self.mad[candidates]]] = True
         else:
-            # DFMS: usar parámetros personalizados o defaults
-            mad_mult = filter_params.get("mad_multiplier_dfms", 800)
-            cps_thresh = filter_params.get("cps_threshold_dfms", 1e8)
-            df = df[(df["cps"].abs() <= mad_mult * mad) & (df["cps"].abs() <= cps_thresh)].copy()
+            keep[self.order[:k]] = True
+        return np.ascontiguousarray(self.x[keep]), np.ascontiguousarray(self.cps[keep])
+
+def _robust_clean_simple(df, detector="RTOF", filter_level="high", **filter_params):
+    """
+    Limpieza robusta sobre un DataFrame con columnas 'x' e 'y'.
+    Wrapper sobre _robust_clean_arrays (ver sus parámetros).
+    
+    Returns:
+        DataFrame con columnas 'x' y 'cps'
+    """
+    import pandas as pd
+    
+    if df.empty:
+        return df
     
-    return df[["x", "cps"]].copy()
+    x, cps = _robust_clean_arrays(
+        df["x"].to_numpy(dtype=float), df["y"].to_numpy(dtype=float),
+        detector, filter_level, **filter_params
+    )
+    return pd.DataFrame({"x": x, "cps": cps})
 
 # -------------------------
 # Función principal para procesar archivo .tab
 # -------------------------
-def process_tab_file(file_stream, filter_level="high", **filter_params):
+def read_tab_xy(file_stream, parse_workers=0):
     """
-    Procesa un archivo .tab desde un stream (BytesIO) y retorna un DataFrame
-    con columnas 'x' (m/z) e 'cps' (intensidad).
-    Sigue la lógica del código de Colab: lee datos después de END.
+    Lee el mejor bloque numérico (sin limpieza) de un archivo .tab en memoria.
     
     Args:
         file_stream: BytesIO con el contenido del archivo .tab
-        filter_level: Nivel de filtrado ("high" para alto grado, "low" para bajo grado)
-        **filter_params: Parámetros opcionales de filtrado:
-            - head_drop: Número de filas iniciales a descartar
-            - mad_multiplier_rtof: Multiplicador MAD para RTOF
-            - cps_threshold_rtof: Umbral absoluto de cps para RTOF
-            - mad_multiplier_dfms: Multiplicador MAD para DFMS
-            - cps_threshold_dfms: Umbral absoluto de cps para DFMS
+        parse_workers: Procesos para parsear en paralelo (ver process_tab_arrays)
     
     Returns:
-        DataFrame con columnas 'x' y 'cps'
+        Tupla (detector, x, y) con x e y en float64
     """
     # Leer encabezado para detectar el detector
     meta = read_label_header_from_stream(file_stream)
-    detector_id = meta.get('DETECTOR_ID', '').upper()
-    detector = "RTOF" if "RTOF" in detector_id else "DFMS" if "DFMS" in detector_id else "RTOF"
+    detector = resolve_detector(meta)
     
-    # Leer líneas después de END
-    lines_after = _read_post_end_lines(file_stream)
+    if parse_workers and parse_workers > 1 and isinstance(file_stream, BytesIO):
+        from parallel_parse import MIN_PARALLEL_BYTES, best_xy_parallel
+        # getvalue() comparte el buffer del BytesIO sin copiarlo si no se ha modificado
+        buf = file_stream.getvalue()
+        use_parallel = len(buf) >= MIN_PARALLEL_BYTES
+    else:
+        use_parallel = False
     
-    if not lines_after:
-        raise ValueError("No se encontraron datos después de la línea END")
+    if use_parallel:
+        # Parseo en paralelo por trozos (mismo resultado que la ruta serial)
+        best_x, best_y = best_xy_parallel(buf, detector, workers=parse_workers)
+    else:
+        # Leer líneas después de END
+        lines_after = _read_post_end_lines(file_stream)
+        
+        if not lines_after:
+            raise ValueError("No se encontraron datos después de la línea END")
+        
+        # Lector rápido según el formato (ver readers.py); None si la sección
+        # no es uniforme y hay que buscar bloques numéricos
+        from readers import read_fast_xy
+        fast = read_fast_xy(file_stream, lines_after, meta, detector)
+        
+        if fast is not None:
+            fmt, best_x, best_y = fast
+            print(f"[INFO] Lector rápido: {fmt} ({detector})")
+        else:
+            # Buscar bloques numéricos
+            blocks = _slice_numeric_blocks(lines_after)
+            
+            if not blocks:
+                raise ValueError("No se encontraron bloques numéricos válidos en el archivo")
+            
+            # Intentar extraer datos de cada bloque y usar el mejor
+            best_x = best_y = np.empty(0, dtype=np.float64)
+            
+            for block in blocks:
+                x_block, y_block = _xy_arrays_from_block(block, detector)
+                if len(x_block) > len(best_x):
+                    best_x, best_y = x_block, y_block
     
-    # Buscar bloques numéricos
-    blocks = _slice_numeric_blocks(lines_after)
+    if len(best_x) == 0:
+        raise ValueError("No se pudieron extraer datos numéricos válidos")
     
-    if not blocks:
-        raise ValueError("No se encontraron bloques numéricos válidos en el archivo")
+    return detector, best_x, best_y
+
+def process_tab_arrays(file_stream, filter_level="high", cps_dtype=np.float64, parse_workers=0, calibrate=False,
+                       **filter_params):
+    """
+    Núcleo NumPy del pipeline: procesa un archivo .tab desde un stream (BytesIO)
+    y retorna arrays contiguos (x, cps), sin usar pandas.
+    Sigue la lógica del código de Colab: lee datos después de END.
     
-    # Intentar extraer datos de cada bloque y usar el mejor
-    best_df = pd.DataFrame(columns=["x", "y"])
-    best_count = 0
+    Args:
+        file_stream: BytesIO con el contenido del archivo .tab
+        filter_level: Nivel de filtrado ("high", "low", "baseline" o "baseline_als")
+        cps_dtype: Tipo de las intensidades durante la limpieza y en la salida
+            (np.float64 por defecto, o np.float32 para el modo de precisión reducida)
+        parse_workers: Procesos para parsear la sección de datos en paralelo
+            (0 = serial). Sólo se usa con BytesIO de al menos PARALLEL_PARSE_MIN_MB.
+        calibrate: Calibrar la escala de m/z con los picos de referencia y la
+            caché por INSTRUMENT_MODE_ID y ventana de tiempo (ver calibration.py)
+        **filter_params: Parámetros opcionales de filtrado (ver process_tab_file)
     
-    for block in blocks:
-        df_block = _xy_from_block(block, detector)
-        if len(df_block) > best_count:
-            best_df = df_block
-            best_count = len(df_block)
+    Returns:
+        Tupla (x, cps) de arrays contiguos (x en float64, cps en `cps_dtype`)
+    """
+    detector, best_x, best_y = read_tab_xy(file_stream, parse_workers=parse_workers)
     
-    if best_df.empty:
-        raise ValueError("No se pudieron extraer datos numéricos válidos")
+    if calibrate:
+        # La limpieza sólo mira cps, así que calibrar antes o después da lo mismo
+        from calibration import calibrate_xy
+        best_x, _ = calibrate_xy(best_x, best_y, read_label_header_from_stream(file_stream), detector)
     
     # Aplicar limpieza robusta con el nivel de filtrado especificado
-    df_clean = _robust_clean_simple(best_df, detector, filter_level, **filter_params)
+    x, cps = _robust_clean_arrays(best_x, best_y, detector, filter_level, cps_dtype=cps_dtype, **filter_params)
     
-    if df_clean.empty:
+    if len(x) == 0:
         raise ValueError("No quedaron datos válidos después de la limpieza")
     
-    return df_clean
+    return x, cps
+
+def process_tab_file(file_stream, filter_level="high", **filter_params):
+    """
+    Procesa un archivo .tab desde un stream (BytesIO) y retorna un DataFrame
+    con columnas 'x' (m/z) e 'cps' (intensidad).
+    Wrapper sobre process_tab_arrays.
+    
+    Args:
+        file_stream: BytesIO con el contenido del archivo .tab
+        filter_level: Nivel de filtrado ("high", "low", "baseline" o "baseline_als")
+        **filter_params: Parámetros opcionales de filtrado:
+            - head_drop: Número de filas iniciales a descartar
+            - mad_multiplier_rtof: Multiplicador MAD para RTOF
+            - cps_threshold_rtof: Umbral absoluto de cps para RTOF
+            - mad_multiplier_dfms: Multiplicador MAD para DFMS
+            - cps_threshold_dfms: Umbral absoluto de cps para DFMS
+    
+    Returns:
+        DataFrame con columnas 'x' y 'cps'
+    """
+    import pandas as pd
+    
+    x, cps = process_tab_arrays(file_stream, filter_level=filter_level, **filter_params)
+    return pd.DataFrame({"x": x, "cps": cps})
+
+
+# -------------------------
+# Resumen del espectro en bins
+# -------------------------
+def summarize_spectrum(x_vals, cps_vals, n_bins=100):
+    """
+    Resume el espectro en `n_bins` bins equiespaciados en m/z.
+    Cada bin con datos retorna el promedio de x y el promedio de los cps no negativos.
+    El promedio se calcula en el dtype de `cps_vals` (float32 en modo de precisión reducida).
+    
+    Returns:
+        Lista de diccionarios {"x": float, "cps": float}
+    """
+    bins = np.linspace(x_vals.min(), x_vals.max(), n_bins + 1)
+    spectrum_summary = []
+
+    # Bin de cada punto: equivalente a (x_vals >= bins[i]) & (x_vals < bins[i+1]).
+    # x == max queda fuera del último bin, igual que con las máscaras.
+    bin_idx = np.searchsorted(bins, x_vals, side='right') - 1
+    valid = (bin_idx >= 0) & (bin_idx < n_bins)
+    bin_idx = bin_idx[valid].astype(np.int16 if n_bins < 2**15 else np.int64)
+
+    # Agrupar por bin con un orden estable: cada bin conserva el orden original
+    # de sus puntos, así que los promedios son idénticos a los de las máscaras
+    order = np.argsort(bin_idx, kind='stable')
+    x_sorted = x_vals[valid][order]
+    cps_sorted = cps_vals[valid][order]
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(bin_idx, minlength=n_bins))))
+
+    for i in range(n_bins):
+        lo, hi = bounds[i], bounds[i+1]
+        if hi > lo:
+            # Calcular promedio solo de valores no negativos en este bin
+            bin_cps = cps_sorted[lo:hi]
+            bin_cps_positive = bin_cps[bin_cps >= 0]
+            
+            if len(bin_cps_positive) > 0:
+                spectrum_summary.append({
+                    "x": float(x_sorted[lo:hi].mean()),
+                    "cps": float(bin_cps_positive.mean())
+                })
 
+    return spectrum_summary
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Emparejamiento local de espectros contra una biblioteca de masas de referencia.
+
+La biblioteca (data/species_masses.csv) lista, por especie, los iones de su
+patrón de fragmentación con su m/z y su intensidad relativa. Se indexa como un
+array ordenado de m/z, así que las búsquedas con tolerancia son searchsorted
+vectorizados. Cada línea se puntúa por la altura del pico en su ventana frente
+al ruido del espectro, y cada especie por sus líneas detectadas ponderadas por
+intensidad relativa.
+"""
+import csv
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_LIBRARY_PATH = Path(__file__).resolve().parent / "data" / "species_masses.csv"
+
+# Tolerancia en m/z por detector: max(tol_abs, mz * tol_ppm * 1e-6)
+DETECTOR_TOLERANCES = {
+    "DFMS": {"tol_abs": 0.01, "tol_ppm": 200.0},
+    "RTOF": {"tol_abs": 0.2, "tol_ppm": 0.0},
+}
+
+# Límite de SNR por línea para que un pico saturado no domine la puntuación
+_SNR_CAP = 50.0
+
+
+class ReferenceLibrary:
+    """Líneas de referencia ordenadas por m/z."""
+
+    def __init__(self, species, names, ions, mz, rel_intensity):
+        mz = np.asarray(mz, dtype=np.float64)
+        order = np.argsort(mz, kind='stable')
+
+        self.mz = np.ascontiguousarray(mz[order])
+        self.rel_intensity = np.asarray(rel_intensity, dtype=np.float64)[order]
+        self.ions = [ions[i] for i in order]
+
+        # Especies como códigos enteros para agregar con bincount
+        self.species = []
+        self.names = {}
+        codes = {}
+        for sp, name in zip(species, names):
+            if sp not in codes:
+                codes[sp] = len(self.species)
+                self.species.append(sp)
+                self.names[sp] = name
+        self.species_code = np.array([codes[species[i]] for i in order], dtype=np.int64)
+
+        # Línea principal (mayor intensidad relativa) de cada especie
+        n_species = len(self.species)
+        self.main_line = np.full(n_species, -1, dtype=np.int64)
+        for line in np.argsort(-self.rel_intensity, kind='stable'):
+            code = self.species_code[line]
+            if self.main_line[code] < 0:
+                self.main_line[code] = line
+
+    def __len__(self):
+        return len(self.mz)
+
+    @classmethod
+    def from_csv(cls, path=DEFAULT_LIBRARY_PATH):
+        """Carga la biblioteca desde un CSV (las líneas que empiezan con '#' se ignoran)."""
+        species, names, ions, mz, rel = [], [], [], [], []
+        with open(path, encoding='utf-8') as f:
+            rows = csv.DictReader(line for line in f if line.strip() and not line.startswith('#'))
+            for row in rows:
+                species.append(row['species'].strip())
+                names.append((row.get('name') or row['species']).strip())
+                ions.append(row['ion'].strip())
+                mz.append(float(row['mz']))
+                rel.append(float(row.get('rel_intensity') or 100))
+        if not mz:
+            raise ValueError(f"La biblioteca de referencia está vacía: {path}")
+        return cls(species, names, ions, mz, rel)
+
+
+_default_library = None
+
+
+def get_default_library():
+    """Biblioteca por defecto (se carga una sola vez)."""
+    global _default_library
+    if _default_library is None:
+        _default_library = ReferenceLibrary.from_csv(DEFAULT_LIBRARY_PATH)
+    return _default_library
+
+
+def match_spectrum(x, cps, detector="RTOF", library=None, tol_abs=None, tol_ppm=None,
+                   snr_min=5.0, top_n=10):
+    """
+    Puntúa un espectro centrado contra la biblioteca. Tiene que ser el espectro
+    antes de los umbrales de cps/MAD (RefilterIndex.x / .cps): los umbrales de
+    alto grado eliminan los picos.
+
+    Args:
+        x, cps: arrays del espectro
+        detector: "RTOF" o "DFMS" (define la tolerancia por defecto)
+        library: ReferenceLibrary (default: data/species_masses.csv)
+        tol_abs, tol_ppm: tolerancia en m/z (default: DETECTOR_TOLERANCES)
+        snr_min: SNR mínimo para considerar detectada una línea
+        top_n: número máximo de candidatos a retornar
+
+    Returns:
+        Lista de candidatos ordenada por puntuación, cada uno:
+        {"species", "name", "score", "lines": [{"ion", "mz_ref", "mz_obs", "delta_mz", "snr"}]}
+    """
+    library = library or get_default_library()
+    tols = DETECTOR_TOLERANCES.get(detector.upper(), DETECTOR_TOLERANCES["RTOF"])
+    tol_abs = tols["tol_abs"] if tol_abs is None else tol_abs
+    tol_ppm = tols["tol_ppm"] if tol_ppm is None else tol_ppm
+
+    x = np.asarray(x, dtype=np.float64)
+    cps = np.asarray(cps, dtype=np.float64)
+    if len(x) == 0:
+        return []
+
+    order = np.argsort(x, kind='stable')
+    xs, cs = x[order], cps[order]
+
+    # Ruido robusto del espectro
+    base = np.median(cs)
+    sigma = 1.4826 * np.median(np.abs(cs - base)) + 1e-12
+
+    # Ventana de cada línea de referencia en el espectro ordenado
+    ref_mz = library.mz
+    tol = np.maximum(tol_abs, ref_mz * tol_ppm * 1e-6)
+    lo = np.searchsorted(xs, ref_mz - tol, side='left')
+    hi = np.searchsorted(xs, ref_mz + tol, side='right')
+    covered = hi > lo
+
+    # Máximo de cada ventana con un único reduceat sobre índices intercalados
+    padded = np.append(cs, -np.inf)
+    bounds = np.empty(2 * len(ref_mz), dtype=np.int64)
+    bounds[0::2] = lo
+    bounds[1::2] = hi
+    peak = np.where(covered, np.maximum.reduceat(padded, bounds)[0::2], np.nan)
+
+    snr = np.where(covered, (peak - base) / sigma, 0.0)
+    detected = covered & (snr >= snr_min)
+
+    # Puntuación por especie: SNR (acotado) ponderado por intensidad relativa,
+    # sólo sobre las líneas que caen dentro del rango medido
+    weight = library.rel_intensity / 100.0
+    n_species = len(library.species)
+    evidence = np.bincount(library.species_code, weights=np.where(detected, weight * np.minimum(snr, _SNR_CAP), 0.0),
+                           minlength=n_species)
+    coverage = np.bincount(library.species_code, weights=np.where(covered, weight, 0.0), minlength=n_species)
+    score = np.divide(evidence, coverage, out=np.zeros(n_species), where=coverage > 0)
+
+    # La línea principal de la especie tiene que estar detectada
+    score[~detected[library.main_line]] = 0.0
+
+    candidates = []
+    for code in np.argsort(-score, kind='stable')[:top_n]:
+        if score[code] <= 0:
+            break
+        lines = []
+        for line in np.flatnonzero(detected & (library.species_code == code)):
+            window = slice(lo[line], hi[line])
+            mz_obs = float(xs[window][np.argmax(cs[window])])
+            lines.append({
+                "ion": library.ions[line],
+                "mz_ref": round(float(ref_mz[line]), 6),
+                "mz_obs": mz_obs,
+                "delta_mz": round(mz_obs - float(ref_mz[line]), 6),
+                "snr": round(float(snr[line]), 2),
+            })
+        species = library.species[code]
+        candidates.append({
+            "species": species,
+            "name": library.names[species],
+            "score": round(float(score[code]), 3),
+            "lines": lines,
+        })
+
+    return candidates
+
+
+def format_candidates(candidates, max_items=10):
+    """Texto breve con los candidatos, para el prompt o como conclusión local."""
+    if not candidates:
+        return "Sin coincidencias en la biblioteca de referencia"
+    parts = []
+    for c in candidates[:max_items]:
+        ions = ", ".join(f"{l['ion']} {l['mz_obs']:.3f}" for l in c["lines"])
+        parts.append(f"{c['species']} ({c['name']}, puntuación {c['score']:.2f}): {ions}")
+    return "\n".join(parts)
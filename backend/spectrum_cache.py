@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de espectros ya parseados para /refilter.
+
+/process guarda el mejor bloque (x, y sin limpiar) y el detector bajo un
+spectrum_id. /refilter reutiliza esos arrays y los RefilterIndex ya
+construidos, así que mover los sliders no vuelve a subir ni parsear el archivo.
+
+y se guarda en float64 aunque la petición use precision=float32: cada índice
+vuelve a centrar y sin limpiar en float64 (ver _robust_center) y sólo su cps
+queda en float32, así que el modo float32 reduce el tamaño de los índices y
+no el de la entrada cruda.
+
+Hay dos backends:
+    memory: LRU en memoria del proceso (un único worker)
+    file:   arrays en archivos .npy (abiertos con mmap) e índice en SQLite,
+            compartidos por todos los workers de la máquina; así un
+            spectrum_id sirve sin importar qué worker atienda /refilter
+
+Variables de entorno:
+    SPECTRUM_CACHE_BACKEND:  "memory" o "file" (default: memory)
+    SPECTRUM_CACHE_DIR:      carpeta del backend file (default: <tmp>/rosetta_spectra)
+    SPECTRUM_CACHE_MAX_MB:   memoria (o disco, en el backend file) máxima en MB (default: 512)
+    SPECTRUM_CACHE_TTL:      segundos sin uso antes de expirar (default: 1800)
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from env_config import env_float
+from rosetta_pipeline import RefilterIndex
+from species_matching import match_spectrum
+
+# Índices (filter_level, head_drop, precisión) guardados por espectro
+_MAX_INDEXES_PER_SPECTRUM = 4
+
+# Espectros con índices en memoria por worker (backend file)
+_MAX_LOCAL_ENTRIES = 8
+
+
+class CachedSpectrum:
+    """
+    Espectro parseado, sus índices de refiltrado y los candidatos de la
+    biblioteca de cada índice (no dependen de los umbrales, así que mover los
+    sliders no vuelve a emparejar).
+    """
+
+    def __init__(self, x, y, detector):
+        self.x = x
+        self.y = y
+        self.detector = detector
+        self.indexes = OrderedDict()
+        self.candidates = {}
+        self.last_used = time.monotonic()
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + sum(i.nbytes for i in self.indexes.values())
+
+    def get_index(self, filter_level, head_drop, cps_dtype):
+        """Retorna (y construye si hace falta) el RefilterIndex para estos parámetros."""
+        key = (filter_level, head_drop, np.dtype(cps_dtype).name)
+        index = self.indexes.get(key)
+        if index is None:
+            index = RefilterIndex(self.x, self.y, self.detector, filter_level, cps_dtype, head_drop)
+            self.indexes[key] = index
+            while len(self.indexes) > _MAX_INDEXES_PER_SPECTRUM:
+                old_key, _ = self.indexes.popitem(last=False)
+                self.candidates.pop(old_key, None)
+        else:
+            self.indexes.move_to_end(key)
+        return index
+
+    def get_candidates(self, filter_level, head_drop, cps_dtype):
+        """
+        Candidatos de match_spectrum sobre el espectro centrado del índice
+        (antes de los umbrales), calculados una vez por índice.
+        """
+        index = self.get_index(filter_level, head_drop, cps_dtype)
+        key = (filter_level, head_drop, np.dtype(cps_dtype).name)
+        candidates = self.candidates.get(key)
+        if candidates is None:
+            candidates = match_spectrum(index.x, index.cps, detector=self.detector)
+            self.candidates[key] = candidates
+        return candidates
+
+
+class SpectrumCache:
+    """LRU con límite de memoria y expiración por inactividad."""
+
+    def __init__(self, max_bytes, ttl=1800):
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=env_float("SPECTRUM_CACHE_MAX_MB", 512) * 1024 * 1024,
+            ttl=env_float("SPECTRUM_CACHE_TTL", 1800),
+        )
+
+    def put(self, x, y, detector):
+        """Guarda un espectro parseado y retorna su spectrum_id."""
+        spectrum_id = uuid.uuid4().hex
+        entry = CachedSpectrum(x, y, detector)
+        with self._lock:
+            self._entries[spectrum_id] = entry
+            self._evict()
+        return spectrum_id
+
+    def get(self, spectrum_id):
+        """Retorna el CachedSpectrum o None si no existe o expiró."""
+        with self._lock:
+            entry = self._entries.get(spectrum_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.last_used > self.ttl:
+                del self._entries[spectrum_id]
+                return None
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(spectrum_id)
+            return entry
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if now - e.last_used > self.ttl]:
+            del self._entries[key]
+        total = sum(e.nbytes for e in self._entries.values())
+        # Siempre se conserva la entrada más reciente
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            total -= old.nbytes
+
+    def trim(self):
+        """Reaplica los límites (p. ej. después de construir un índice nuevo)."""
+        with self._lock:
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": sum(e.nbytes for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+            }
+
+
+class FileSpectrumCache:
+    """
+    Caché compartida entre procesos: x e y en archivos .npy y un índice SQLite
+    con detector, tamaño y último uso. Cada worker abre los arrays con mmap
+    (el sistema operativo comparte las páginas) y guarda sus RefilterIndex en
+    un LRU local pequeño.
+    """
+
+    def __init__(self, directory, max_bytes, ttl=1800, max_local=_MAX_LOCAL_ENTRIES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.directory / "index.sqlite3"
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+        self.max_local = int(max_local)
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS spectra ("
+                "id TEXT PRIMARY KEY, detector TEXT NOT NULL, "
+                "nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv("SPECTRUM_CACHE_DIR") or Path(tempfile.gettempdir()) / "rosetta_spectra",
+            max_bytes=env_float("SPECTRUM_CACHE_MAX_MB", 512) * 1024 * 1024,
+            ttl=env_float("SPECTRUM_CACHE_TTL", 1800),
+        )
+
+    @contextmanager
+    def _connect(self):
+        """Conexión SQLite por operación (commit al salir del bloque y cierre)."""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _paths(self, spectrum_id):
+        return self.directory / f"{spectrum_id}.x.npy", self.directory / f"{spectrum_id}.y.npy"
+
+    def _remember(self, spectrum_id, entry):
+        self._local[spectrum_id] = entry
+        self._local.move_to_end(spectrum_id)
+        while len(self._local) > self.max_local:
+            self._local.popitem(last=False)
+
+    def put(self, x, y, detector):
+        """Guarda un espectro parseado y retorna su spectrum_id."""
+        spectrum_id = uuid.uuid4().hex
+        for path, arr in zip(self._paths(spectrum_id), (x, y)):
+            # Escritura atómica: otro worker nunca ve un archivo a medias
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, path)
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO spectra (id, detector, nbytes, last_used) VALUES (?, ?, ?, ?)",
+                (spectrum_id, detector, int(x.nbytes + y.nbytes), time.time())
+            )
+        with self._lock:
+            self._remember(spectrum_id, CachedSpectrum(x, y, detector))
+        self._evict()
+        return spectrum_id
+
+    def get(self, spectrum_id):
+        """Retorna el CachedSpectrum o None si no existe o expiró."""
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT detector, last_used FROM spectra WHERE id = ?", (spectrum_id,)).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                db.execute("UPDATE spectra SET last_used = ? WHERE id = ?", (now, spectrum_id))
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                self._delete([spectrum_id])
+            else:
+                with self._lock:
+                    self._local.pop(spectrum_id, None)
+            return None
+
+        with self._lock:
+            entry = self._local.get(spectrum_id)
+            if entry is None:
+                x_path, y_path = self._paths(spectrum_id)
+                try:
+                    x = np.load(x_path, mmap_mode="r")
+                    y = np.load(y_path, mmap_mode="r")
+                except FileNotFoundError:
+                    return None
+                entry = CachedSpectrum(x, y, row[0])
+            entry.last_used = time.monotonic()
+            self._remember(spectrum_id, entry)
+            return entry
+
+    def _delete(self, ids):
+        if not ids:
+            return
+        with self._connect() as db:
+            db.executemany("DELETE FROM spectra WHERE id = ?", [(i,) for i in ids])
+        with self._lock:
+            for spectrum_id in ids:
+                self._local.pop(spectrum_id, None)
+        for spectrum_id in ids:
+            for path in self._paths(spectrum_id):
+                # Un worker que todavía tenga el mmap abierto lo sigue leyendo
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self):
+        now = time.time()
+        with self._connect() as db:
+            rows = db.execute("SELECT id, nbytes, last_used FROM spectra ORDER BY last_used DESC").fetchall()
+        expired = [r[0] for r in rows if now - r[2] > self.ttl]
+        live = [r for r in rows if now - r[2] <= self.ttl]
+        # Siempre se conserva la entrada más reciente
+        total = 0
+        for i, (spectrum_id, nbytes, _) in enumerate(live):
+            total += nbytes
+            if total > self.max_bytes and i > 0:
+                expired.append(spectrum_id)
+        self._delete(expired)
+
+    def trim(self):
+        """Reaplica los límites (índices locales y archivos compartidos)."""
+        with self._lock:
+            while len(self._local) > 1 and sum(e.nbytes for e in self._local.values()) > self.max_bytes:
+                self._local.popitem(last=False)
+        self._evict()
+
+    def stats(self):
+        with self._connect() as db:
+            entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM spectra").fetchone()
+        with self._lock:
+            local = len(self._local)
+        return {
+            "backend": "file",
+            "entries": entries,
+            "bytes": total,
+            "local_entries": local,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
+
+
+def spectrum_cache_from_env():
+    """Crea la caché según SPECTRUM_CACHE_BACKEND ("memory" o "file")."""
+    backend = os.getenv("SPECTRUM_CACHE_BACKEND", "memory").strip().lower()
+    if backend == "file":
+        return FileSpectrumCache.from_env()
+    if backend != "memory":
+        print(f"[WARNING] SPECTRUM_CACHE_BACKEND desconocido: {backend}, usando memory")
+    return SpectrumCache.from_env()
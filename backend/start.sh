@@ -6,5 +6,11 @@ echo "  source venv/bin/activate"
 echo ""
 echo "Y de haber configurado el archivo .env con tu OPENAI_API_KEY"
 echo ""
+if [ "$1" = "prod" ]; then
+    # Varios workers (ver gunicorn.conf.py)
+    echo "Modo producción: gunicorn con workers de uvicorn"
+    exec gunicorn app:app -c gunicorn.conf.py
+fi
+
 uvicorn app:app --host 0.0.0.0 --port 8000 --reload
 
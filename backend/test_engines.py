@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas offline de los motores del pipeline (pytest).
+
+Corre las comprobaciones de validate_engines.py sobre los archivos pequeños
+del corpus sintético, sin archivos reales ni red:
+
+    cd backend && python -m pytest -q test_engines.py
+
+Cada motor se compara contra la referencia independiente (reference_pipeline
+y reference_baseline) y la referencia contra los resultados guardados en
+golden/.
+"""
+from functools import lru_cache
+
+import numpy as np
+import pytest
+
+import validate_engines as V
+from rosetta_pipeline import FILTER_LEVELS
+
+
+@lru_cache(maxsize=1)
+def _corpus():
+    corpus = V.synthetic_corpus()
+    return {name: corpus[name] for name in V.GOLDEN_SYNTHETIC}
+
+
+@lru_cache(maxsize=None)
+def _reference(name, level):
+    return V._reference(_corpus()[name], level)
+
+
+@pytest.mark.parametrize("level", FILTER_LEVELS)
+@pytest.mark.parametrize("name", V.GOLDEN_SYNTHETIC)
+def test_reference_matches_golden(name, level):
+    ok, detail = V.check_golden(V.GOLDEN_DIR, name, level, _reference(name, level))
+    assert ok, detail
+
+
+@pytest.mark.parametrize("engine", [e for e, (_, exact) in V.ENGINES.items() if exact])
+@pytest.mark.parametrize("level", FILTER_LEVELS)
+@pytest.mark.parametrize("name", V.GOLDEN_SYNTHETIC)
+def test_exact_engine_matches_reference(name, level, engine):
+    fn, _ = V.ENGINES[engine]
+    out = fn(_corpus()[name], level)
+    ok, detail = V.compare_exact(_reference(name, level), out, *V.level_tolerance(level))
+    assert ok, detail
+
+
+@pytest.mark.parametrize("level", FILTER_LEVELS)
+@pytest.mark.parametrize("name", V.GOLDEN_SYNTHETIC)
+def test_float32_bins_match_reference(name, level):
+    out = V._float32(_corpus()[name], level)
+    assert out[1].dtype == np.float32
+    ok, detail = V.compare_bins(_reference(name, level), out)
+    assert ok, detail
+
+
+@pytest.mark.parametrize("case", V.check_matching(), ids=lambda case: case[0])
+def test_matching_finds_known_species(case):
+    _, ok, detail = case
+    assert ok, detail
+
+
+def test_fast_readers():
+    results = V.check_readers(_corpus())
+    assert len(results) == len(V.READER_FORMATS)
+    for name, ok, detail in results:
+        assert ok, f"{name}: {detail}"
+
+
+def test_calibration():
+    for case, ok, detail in V.check_calibration():
+        assert ok, f"{case}: {detail}"
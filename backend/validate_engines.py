@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""
+Regresión de resultados: compara la ruta de referencia del pipeline contra
+los motores actuales (NumPy, DataFrame, streaming, paralela, refiltrado, float32).
+
+La referencia de los niveles "high" y "low" es la copia congelada del
+pipeline original con pandas (reference_pipeline.py), independiente del
+núcleo actual. Los niveles con línea base no existían en el original: su
+referencia es reference_baseline.py, escrita aparte sobre la misma lectura
+congelada (en "baseline_als" se compara con la tolerancia ALS_ATOL/ALS_RTOL).
+
+Para cada archivo y nivel de filtrado procesa el .tab con la referencia y con
+cada motor, y reporta lado a lado si el resultado coincide dentro de la
+tolerancia, el speedup y la diferencia de memoria pico (tracemalloc) frente a
+la referencia.
+
+Los motores exactos deben dar los mismos (x, cps) que la referencia (por
+defecto bit a bit, ver --atol/--rtol). Los motores con pérdida (float32) se
+comparan sobre el resumen en bins que se envía al modelo (--max-bin-cps).
+
+Con --synthetic también se comprueba que el emparejamiento local encuentre
+las especies de un espectro con picos conocidos, que los archivos del corpus
+se lean con el lector rápido esperado (readers.py) y que la calibración de
+m/z corrija un desplazamiento conocido (calibration.py).
+
+test_engines.py corre las mismas comprobaciones con pytest sobre los archivos
+pequeños del corpus.
+
+Con --golden DIR la salida de la referencia se compara además contra
+resultados guardados (DIR/<archivo>.<nivel>.npz); --update-golden los
+regenera. Con --synthetic se usa un corpus sintético determinista, así que
+el script corre sin archivos reales ni red (p. ej. en CI); los archivos
+pequeños del corpus tienen sus resultados guardados en el repositorio
+(golden/) y siempre se comparan contra ellos.
+
+Uso:
+    python validate_engines.py archivo1.tab carpeta_con_tabs/ [--levels high low]
+    python validate_engines.py --synthetic [--golden golden/]
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+import reference_baseline
+import reference_pipeline
+from rosetta_pipeline import (
+    FILTER_LEVELS, RefilterIndex, _robust_clean_arrays, open_tab_text_stream,
+    process_tab_arrays, process_tab_file, process_tab_lines, read_label_header_from_stream,
+    resolve_detector, summarize_spectrum,
+)
+from validate_precision import _collect_files
+
+
+# Resultados guardados del corpus sintético (versionados en el repositorio)
+GOLDEN_DIR = Path(__file__).resolve().parent / "golden"
+GOLDEN_SYNTHETIC = ("sint_rtof_small", "sint_dfms_small", "sint_rtof_uniform", "sint_dfms_fixed")
+
+# Niveles que existen en el pipeline original
+REFERENCE_LEVELS = ("high", "low")
+
+# Lector rápido esperado para los archivos del corpus sin bloques espurios
+READER_FORMATS = {"sint_rtof_uniform": "whitespace", "sint_dfms_fixed": "fixed_width"}
+
+
+# -------------------------
+# Motores
+# -------------------------
+def _reference(contents, filter_level, **filter_params):
+    if filter_level in REFERENCE_LEVELS:
+        df = reference_pipeline.process_tab_file(BytesIO(contents), filter_level=filter_level, **filter_params)
+        return df["x"].to_numpy(dtype=np.float64), df["cps"].to_numpy(dtype=np.float64)
+    return reference_baseline.process_tab_file(BytesIO(contents), filter_level=filter_level, **filter_params)
+
+
+def level_tolerance(level, atol=0.0, rtol=0.0):
+    """(atol, rtol) con que se compara un nivel contra su referencia."""
+    if level == "baseline_als":
+        return max(atol, reference_baseline.ALS_ATOL), max(rtol, reference_baseline.ALS_RTOL)
+    return atol, rtol
+
+
+def _numpy(contents, filter_level, **filter_params):
+    return process_tab_arrays(BytesIO(contents), filter_level=filter_level, **filter_params)
+
+
+def _dataframe(contents, filter_level, **filter_params):
+    df = process_tab_file(BytesIO(contents), filter_level=filter_level, **filter_params)
+    return df["x"].to_numpy(), df["cps"].to_numpy()
+
+
+def _streaming(contents, filter_level, **filter_params):
+    with open_tab_text_stream("archivo.tab", BytesIO(contents)) as text_stream:
+        return process_tab_lines(text_stream, filter_level=filter_level, **filter_params)
+
+
+def _streaming_gzip(contents, filter_level, **filter_params):
+    import gzip
+    compressed = gzip.compress(contents, compresslevel=1)
+    with open_tab_text_stream("archivo.tab.gz", BytesIO(compressed)) as text_stream:
+        return process_tab_lines(text_stream, filter_level=filter_level, **filter_params)
+
+
+def _parallel(contents, filter_level, workers=2, **filter_params):
+    # best_xy_parallel directamente: ignora PARALLEL_PARSE_MIN_MB para poder
+    # validar también archivos pequeños
+    from parallel_parse import best_xy_parallel
+    detector = _detector(contents)
+    best_x, best_y = best_xy_parallel(contents, detector, workers=workers)
+    x, cps = _robust_clean_arrays(best_x, best_y, detector, filter_level, **filter_params)
+    if len(x) == 0:
+        raise ValueError("No quedaron datos válidos después de la limpieza")
+    return x, cps
+
+
+def _refilter(contents, filter_level, **filter_params):
+    from rosetta_pipeline import read_tab_xy
+    detector, best_x, best_y = read_tab_xy(BytesIO(contents))
+    index = RefilterIndex(best_x, best_y, detector, filter_level, np.float64, filter_params.get("head_drop"))
+    x, cps = index.apply(**filter_params)
+    if len(x) == 0:
+        raise ValueError("No quedaron datos válidos después de la limpieza")
+    return x, cps
+
+
+def _float32(contents, filter_level, **filter_params):
+    return process_tab_arrays(BytesIO(contents), filter_level=filter_level, cps_dtype=np.float32,
+                              **filter_params)
+
+
+def _detector(contents):
+    return resolve_detector(read_label_header_from_stream(BytesIO(contents)))
+
+
+# nombre -> (función, exacto)
+ENGINES = {
+    "numpy": (_numpy, True),
+    "dataframe": (_dataframe, True),
+    "streaming": (_streaming, True),
+    "streaming_gzip": (_streaming_gzip, True),
+    "parallel": (_parallel, True),
+    "refilter": (_refilter, True),
+    "float32": (_float32, False),
+}
+
+
+# -------------------------
+# Corpus sintético
+# -------------------------
+def synthetic_corpus(scale=1):
+    """
+    Archivos .tab sintéticos deterministas (nombre -> bytes): RTOF separado
+    por espacios y DFMS separado por comas, con línea base que deriva, picos,
+    CRLF y bloques numéricos espurios antes y después de la tabla. Los
+    archivos "uniform" y "fixed" no tienen bloques espurios, así que se leen
+    con el lector rápido (readers.read_fast_xy) en lugar de la búsqueda de
+    bloques numéricos; "fixed" define sus columnas con bloques
+    OBJECT = COLUMN en el label (lector fixed_width).
+    """
+    specs = [
+        ("sint_rtof_small", "RTOF", 3000, 0, False),
+        ("sint_dfms_small", "DFMS", 2000, 1, False),
+        ("sint_rtof_uniform", "RTOF", 4000, 5, True),
+        ("sint_dfms_fixed", "DFMS", 2500, 6, True),
+        ("sint_rtof_drift", "RTOF", 50000 * scale, 2, False),
+        ("sint_dfms_drift", "DFMS", 30000 * scale, 3, False),
+        ("sint_rtof_large", "RTOF", 300000 * scale, 4, False),
+    ]
+    corpus = {}
+    for name, detector, rows, seed, uniform in specs:
+        rng = np.random.default_rng(seed)
+        x = np.linspace(1.0, 150.0, rows)
+        y = rng.normal(100.0, 2.0, rows) + np.linspace(0.0, 40.0 * (seed % 3), rows)
+        peaks = rng.integers(0, rows, max(5, rows // 100))
+        y[peaks] += rng.uniform(10.0, 1e5, len(peaks))
+
+        label = [
+            "PDS_VERSION_ID = PDS3",
+            "RECORD_TYPE = FIXED_LENGTH",
+            "INSTRUMENT_ID = ROSINA",
+            f'DETECTOR_ID = "{detector}"',
+            'INSTRUMENT_MODE_ID = "M0100"',
+            f"PRODUCT_ID = {name.upper()}",
+            f"ROWS = {rows}",
+        ]
+        fixed = name.endswith("_fixed")
+        if fixed:
+            for col, start, width in (("INDEX", 1, 8), ("MASS", 9, 10), ("CPS", 19, 11)):
+                label += ["OBJECT = COLUMN", f"  NAME = {col}", f"  START_BYTE = {start}",
+                          f"  BYTES = {width}", "END_OBJECT = COLUMN"]
+        label.append("END")
+        body = [] if uniform else ["OBJECT = TABLE", "1 2", "3 4 5"]
+        if fixed:
+            body += [f"{i:8d}{x[i]:10.5f} {y[i]:10.4E}" for i in range(rows)]
+        elif detector == "RTOF":
+            body += [f"{i} {x[i]:.5f} {2 * i} {y[i]:.4E}" for i in range(rows)]
+        else:
+            body += [f"{i}, {x[i]:.5f}, {y[i]:.4E}, 0" for i in range(rows)]
+        if not uniform:
+            body += ["END_OBJECT = TABLE", "7 8 9", "1 2 3", "4 5 6"]
+        corpus[name] = ("\r\n".join(label + body) + "\r\n").encode("latin-1")
+    return corpus
+
+
+# -------------------------
+# Emparejamiento local
+# -------------------------
+# Especies con picos de 300 cps en el espectro de control (y su m/z)
+MATCHING_PEAKS = {"H2O": 18.010565, "N2": 28.006148, "O2": 31.989829, "CO2": 43.989830}
+
+
+def check_matching(levels=("high", "baseline", "low")):
+    """
+    Emparejamiento sobre un espectro RTOF con picos conocidos, por el mismo
+    camino que /process (RefilterIndex con los umbrales por defecto).
+    Retorna una lista de (nivel, ok, detalle).
+    """
+    from species_matching import match_spectrum
+    rng = np.random.default_rng(7)
+    x = np.arange(1.0, 100.0, 0.01)
+    y = rng.normal(100.0, 2.0, len(x))
+    for mz in MATCHING_PEAKS.values():
+        y += 300.0 * np.exp(-0.5 * ((x - mz) / 0.03) ** 2)
+
+    results = []
+    for level in levels:
+        index = RefilterIndex(x, y, "RTOF", level)
+        candidates = match_spectrum(index.x, index.cps, detector="RTOF")
+        found = {c["species"] for c in candidates}
+        missing = sorted(set(MATCHING_PEAKS) - found)
+        results.append((level, not missing, f"faltan {missing}" if missing else f"{len(candidates)} candidatos"))
+    return results
+
+
+def check_readers(corpus):
+    """
+    Comprueba que los archivos de READER_FORMATS se lean con su lector rápido.
+    Retorna una lista de (archivo, ok, detalle).
+    """
+    from readers import read_fast_xy
+    from rosetta_pipeline import _read_post_end_lines
+    results = []
+    for name, expected in READER_FORMATS.items():
+        if name not in corpus:
+            continue
+        stream = BytesIO(corpus[name])
+        meta = read_label_header_from_stream(stream)
+        fast = read_fast_xy(stream, _read_post_end_lines(stream), meta, resolve_detector(meta))
+        fmt = fast[0] if fast else None
+        results.append((name, fmt == expected, f"lector {fmt} (esperado {expected})"))
+    return results
+
+
+# -------------------------
+# Calibración de m/z
+# -------------------------
+# Escala sin calibrar del espectro de control: x = (m/z - b) / a
+CALIBRATION_SHIFT = (1.0004, -0.012)
+CALIBRATION_MAX_ERROR = 2e-3
+
+
+def _calibration_spectrum(seed=11):
+    """Espectro DFMS alrededor de las líneas principales de la biblioteca, con x desplazado."""
+    from species_matching import get_default_library
+    library = get_default_library()
+    rng = np.random.default_rng(seed)
+    centers = np.unique(library.mz[library.main_line])
+    centers = centers[(centers > 10) & (centers < 50)]
+    mz = np.concatenate([np.linspace(c - 0.5, c + 0.5, 2000) for c in centers])
+    y = rng.normal(100.0, 2.0, len(mz))
+    for line, rel in zip(library.mz, library.rel_intensity):
+        y += 50.0 * rel * np.exp(-0.5 * ((mz - line) / 0.004) ** 2)
+    a, b = CALIBRATION_SHIFT
+    return (mz - b) / a, y, mz
+
+
+def check_calibration():
+    """
+    Calibración de m/z sobre un espectro con un desplazamiento conocido: el
+    ajuste debe corregirlo, el segundo archivo de la misma clave debe reusar
+    el ajuste y un archivo sin INSTRUMENT_MODE_ID no debe quedar en caché.
+    Retorna una lista de (caso, ok, detalle).
+    """
+    from calibration import CalibrationCache, calibrate_xy
+    x, y, mz = _calibration_spectrum()
+    meta = {"INSTRUMENT_MODE_ID": "M0212", "START_TIME": "2015-03-01T10:00:00"}
+    cache = CalibrationCache()
+    results = []
+
+    xc, calibration = calibrate_xy(x, y, meta, "DFMS", cache=cache)
+    error = float(np.abs(xc - mz).max()) if calibration else float("inf")
+    results.append(("ajuste", error <= CALIBRATION_MAX_ERROR,
+                    f"max|dm/z| {error:.2e} (sin calibrar {np.abs(x - mz).max():.2e})"))
+
+    later = dict(meta, START_TIME="2015-03-01T20:00:00")
+    _, reused = calibrate_xy(x, y, later, "DFMS", cache=cache)
+    results.append(("caché", reused is calibration, "misma clave reutiliza el ajuste"))
+
+    _, alone = calibrate_xy(x, y, {"START_TIME": meta["START_TIME"]}, "DFMS", cache=cache)
+    stored = len(cache._entries)
+    results.append(("sin modo", alone is not None and stored == 1, f"{stored} ajustes en caché"))
+    return results
+
+
+# -------------------------
+# Medición y comparación
+# -------------------------
+def measure(fn, contents, filter_level, repeat=3, **filter_params):
+    """
+    Ejecuta `fn` y retorna (resultado, mejor tiempo en s, memoria pico en bytes).
+    La memoria se mide con tracemalloc en una ejecución aparte (no cuenta la
+    de los procesos hijos del parseo en paralelo).
+    """
+    best = float('inf')
+    result = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        result = fn(contents, filter_level, **filter_params)
+        best = min(best, time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        fn(contents, filter_level, **filter_params)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def _bins(x, cps):
+    keep = cps >= 0
+    summary = summarize_spectrum(x[keep], cps[keep])
+    return (np.array([b["x"] for b in summary], dtype=np.float64),
+            np.array([b["cps"] for b in summary], dtype=np.float64))
+
+
+def compare_exact(ref, out, atol=0.0, rtol=0.0):
+    """Compara (x, cps) punto a punto. Retorna (ok, detalle)."""
+    (x0, c0), (x1, c1) = ref, out
+    if len(x0) != len(x1):
+        return False, f"puntos {len(x0)} != {len(x1)}"
+    if atol == 0 and rtol == 0:
+        ok = np.array_equal(x0, x1) and np.array_equal(c0, c1.astype(c0.dtype, copy=False))
+        return ok, "idéntico" if ok else "difiere bit a bit"
+    ok = (np.allclose(x0, x1, atol=atol, rtol=rtol)
+          and np.allclose(c0, c1.astype(np.float64), atol=atol, rtol=rtol))
+    dmax = float(np.abs(c0 - c1.astype(np.float64)).max()) if len(c0) else 0.0
+    return ok, f"max|dcps|={dmax:.3e}"
+
+
+def compare_bins(ref, out, max_bin_cps=5e-4):
+    """Compara el resumen en bins (lo que ve el modelo). Retorna (ok, detalle)."""
+    bx0, bc0 = _bins(*ref)
+    bx1, bc1 = _bins(*out)
+    if len(bx0) != len(bx1):
+        return False, f"bins {len(bx0)} != {len(bx1)}"
+    if len(bx0) == 0:
+        return True, "sin bins"
+    dx = float(np.abs(bx0 - bx1).max())
+    dc = float(np.abs(bc0 - bc1).max())
+    return (dx <= max_bin_cps and dc <= max_bin_cps), f"max|dx_bin|={dx:.3e} max|dcps_bin|={dc:.3e}"
+
+
+def _golden_path(golden_dir, name, level):
+    return Path(golden_dir) / f"{name}.{level}.npz"
+
+
+def check_golden(golden_dir, name, level, ref, update=False):
+    """Compara la referencia contra el resultado guardado (o lo regenera)."""
+    path = _golden_path(golden_dir, name, level)
+    x, cps = ref
+    if update or not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, x=x, cps=cps)
+        return True, f"guardado en {path}"
+    golden = np.load(path)
+    return compare_exact((golden["x"], golden["cps"]), ref, *level_tolerance(level))
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara los motores del pipeline contra la ruta de referencia")
+    parser.add_argument('paths', nargs='*', help="Archivos .tab o carpetas")
+    parser.add_argument('--synthetic', action='store_true', help="Incluir el corpus sintético determinista")
+    parser.add_argument('--scale', type=int, default=1, help="Multiplica el tamaño del corpus sintético")
+    parser.add_argument('--levels', nargs='+', default=list(FILTER_LEVELS), choices=list(FILTER_LEVELS))
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--repeat', type=int, default=3, help="Repeticiones para medir tiempos (default: 3)")
+    parser.add_argument('--atol', type=float, default=0.0, help="Tolerancia absoluta de los motores exactos")
+    parser.add_argument('--rtol', type=float, default=0.0, help="Tolerancia relativa de los motores exactos")
+    parser.add_argument('--max-bin-cps', type=float, default=5e-4,
+                        help="Desviación máxima por bin de los motores con pérdida (default: 5e-4)")
+    parser.add_argument('--golden', help="Carpeta con los resultados de referencia guardados")
+    parser.add_argument('--update-golden', action='store_true', help="Regenerar los resultados guardados")
+    args = parser.parse_args(argv)
+
+    corpus = {}
+    if args.synthetic:
+        corpus.update(synthetic_corpus(args.scale))
+    for path in _collect_files(args.paths):
+        corpus[path.stem] = path.read_bytes()
+    if not corpus:
+        print("[ERROR] No se encontraron archivos .tab (usa rutas o --synthetic)")
+        return 2
+
+    if "parallel" in args.engines:
+        # Arrancar el pool antes de medir (spawn tarda en crear los procesos)
+        _parallel(next(iter(corpus.values())), "high")
+
+    failures = 0
+    totals = {name: [0.0, 0.0] for name in args.engines}
+
+    if args.synthetic:
+        checks = [("emparejamiento local", check_matching()), ("lector rápido", check_readers(corpus)),
+                  ("calibración de m/z", check_calibration())]
+        for title, results in checks:
+            for case, ok, detail in results:
+                failures += not ok
+                print(f"[{'OK' if ok else 'FAIL'}] {title} [{case}]: {detail}")
+    for name, contents in corpus.items():
+        for level in args.levels:
+            try:
+                ref, t_ref, m_ref = measure(_reference, contents, level, args.repeat)
+            except ValueError as e:
+                print(f"[WARNING] {name} [{level}]: {e}")
+                continue
+            print(f"[INFO] {name} [{level}] referencia: {len(ref[0])} puntos, "
+                  f"{t_ref * 1000:.1f} ms, pico {m_ref / 1e6:.1f} MB")
+
+            golden_dir = args.golden or (GOLDEN_DIR if args.synthetic and name in GOLDEN_SYNTHETIC else None)
+            if golden_dir:
+                ok, detail = check_golden(golden_dir, name, level, ref, args.update_golden)
+                failures += not ok
+                print(f"  [{'OK' if ok else 'FAIL'}] golden: {detail}")
+
+            for engine in args.engines:
+                fn, exact = ENGINES[engine]
+                try:
+                    out, t, m = measure(fn, contents, level, args.repeat)
+                except Exception as e:
+                    failures += 1
+                    print(f"  [FAIL] {engine}: {type(e).__name__}: {e}")
+                    continue
+                if exact:
+                    ok, detail = compare_exact(ref, out, *level_tolerance(level, args.atol, args.rtol))
+                else:
+                    ok, detail = compare_bins(ref, out, args.max_bin_cps)
+                failures += not ok
+                totals[engine][0] += t_ref
+                totals[engine][1] += t
+                print(f"  [{'OK' if ok else 'FAIL'}] {engine:<15} {detail:<40} "
+                      f"{t * 1000:9.1f} ms  x{t_ref / t if t else float('inf'):5.2f}  "
+                      f"pico {m / 1e6:7.1f} MB ({(m - m_ref) / 1e6:+.1f} MB)")
+
+    for engine, (t_ref, t) in totals.items():
+        if t:
+            print(f"[INFO] {engine}: speedup total x{t_ref / t:.2f}")
+    print(f"[INFO] Archivos: {len(corpus)}, fallos: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
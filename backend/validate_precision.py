@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Valida el modo de precisión reducida (cps en float32) contra la ruta float64.
+
+Procesa un corpus de archivos .tab con ambos modos y reporta, por archivo y
+nivel de filtrado, la desviación máxima de cps y del resumen en bins que se
+envía al modelo.
+
+Uso:
+    python validate_precision.py archivo1.tab carpeta_con_tabs/ [--levels high low]
+"""
+import argparse
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+from rosetta_pipeline import process_tab_arrays, summarize_spectrum
+
+
+def _collect_files(paths):
+    """Expande carpetas a sus archivos .tab (recursivo)."""
+    files = []
+    for p in paths:
+        p = Path(p)
+        if p.is_dir():
+            files.extend(sorted(p.rglob('*.tab')))
+        elif p.is_file():
+            files.append(p)
+        else:
+            print(f"[WARNING] No existe: {p}")
+    return files
+
+
+def compare_precision(contents, filter_level="high", **filter_params):
+    """
+    Procesa `contents` (bytes de un .tab) en float64 y float32 y retorna un
+    diccionario con las diferencias encontradas.
+    """
+    x64, cps64 = process_tab_arrays(BytesIO(contents), filter_level=filter_level,
+                                    cps_dtype=np.float64, **filter_params)
+    x32, cps32 = process_tab_arrays(BytesIO(contents), filter_level=filter_level,
+                                    cps_dtype=np.float32, **filter_params)
+
+    # Puntos comunes (los umbrales pueden dejar pasar puntos distintos en el borde)
+    _, i64, i32 = np.intersect1d(x64, x32, assume_unique=False, return_indices=True)
+    if len(i64) > 0:
+        dcps = np.abs(cps64[i64] - cps32[i32].astype(np.float64))
+        max_dcps = float(dcps.max())
+    else:
+        max_dcps = float('nan')
+
+    s64 = summarize_spectrum(x64[cps64 >= 0], cps64[cps64 >= 0])
+    s32 = summarize_spectrum(x32[cps32 >= 0], cps32[cps32 >= 0])
+    if len(s64) == len(s32) and len(s64) > 0:
+        max_dx_bin = max(abs(a["x"] - b["x"]) for a, b in zip(s64, s32))
+        max_dcps_bin = max(abs(a["cps"] - b["cps"]) for a, b in zip(s64, s32))
+        # Diferencias visibles en el prompt (redondeado a 3 decimales)
+        prompt_diffs = sum(
+            1 for a, b in zip(s64, s32)
+            if f"{a['x']:.3f}:{a['cps']:.3f}" != f"{b['x']:.3f}:{b['cps']:.3f}"
+        )
+    else:
+        max_dx_bin = max_dcps_bin = float('nan')
+        prompt_diffs = None
+
+    return {
+        "points_f64": len(x64),
+        "points_f32": len(x32),
+        "points_common": len(i64),
+        "max_abs_cps": max_dcps,
+        "bins_f64": len(s64),
+        "bins_f32": len(s32),
+        "max_abs_bin_x": max_dx_bin,
+        "max_abs_bin_cps": max_dcps_bin,
+        "prompt_pairs_changed": prompt_diffs,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara la ruta float32 contra float64")
+    parser.add_argument('paths', nargs='+', help="Archivos .tab o carpetas")
+    parser.add_argument('--levels', nargs='+', default=["high", "low"], choices=["high", "low"])
+    parser.add_argument('--max-bin-cps', type=float, default=5e-4,
+                        help="Desviación máxima tolerada en cps por bin (default: 5e-4)")
+    args = parser.parse_args(argv)
+
+    files = _collect_files(args.paths)
+    if not files:
+        print("[ERROR] No se encontraron archivos .tab")
+        return 2
+
+    worst = 0.0
+    failures = 0
+    for path in files:
+        contents = path.read_bytes()
+        for level in args.levels:
+            try:
+                r = compare_precision(contents, filter_level=level)
+            except ValueError as e:
+                print(f"[WARNING] {path.name} [{level}]: {e}")
+                continue
+
+            ok = (r["bins_f64"] == r["bins_f32"]
+                  and not (r["max_abs_bin_cps"] > args.max_bin_cps))
+            if not ok:
+                failures += 1
+            if r["max_abs_bin_cps"] == r["max_abs_bin_cps"]:
+                worst = max(worst, r["max_abs_bin_cps"])
+
+            print(f"[{'OK' if ok else 'FAIL'}] {path.name} [{level}] "
+                  f"puntos={r['points_f64']}/{r['points_f32']} (comunes {r['points_common']}) "
+                  f"max|dcps|={r['max_abs_cps']:.3e} "
+                  f"bins={r['bins_f64']}/{r['bins_f32']} "
+                  f"max|dx_bin|={r['max_abs_bin_x']:.3e} "
+                  f"max|dcps_bin|={r['max_abs_bin_cps']:.3e} "
+                  f"pares_prompt_distintos={r['prompt_pairs_changed']}")
+
+    print(f"[INFO] Archivos: {len(files)}, fallos: {failures}, peor max|dcps_bin|: {worst:.3e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
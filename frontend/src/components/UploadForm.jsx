@@ -26,11 +26,16 @@ ChartJS.register(
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// Extensiones aceptadas (.tab plano o comprimido)
+const TAB_EXTENSIONS = ['.tab', '.tab.gz', '.tab.bz2', '.tab.zst', '.zip'];
+
 function UploadForm() {
   const [spectrum, setSpectrum] = useState(null);
   const [conclusion, setConclusion] = useState('');
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  // Identificador del espectro ya parseado en el backend (para /refilter)
+  const [spectrumId, setSpectrumId] = useState(null);
   // Nivel predefinido para filtrado (1-4)
   const [filterPreset, setFilterPreset] = useState(2); // 1=Muy estricto, 2=Estricto, 3=Moderado, 4=Permisivo
   
@@ -70,31 +75,66 @@ function UploadForm() {
     }
   };
 
+  // Agrega al formulario los parámetros del preset indicado
+  const appendPresetParams = (formData, level) => {
+    formData.append('filter_level', 'high'); // Siempre alto grado
+    
+    // Enviar parámetros del preset seleccionado
+    const preset = filterPresets[level];
+    formData.append('head_drop', preset.headDrop.toString());
+    formData.append('mad_multiplier_rtof', preset.madMultiplierRTOF.toString());
+    formData.append('cps_threshold_rtof', preset.cpsThresholdRTOF.toString());
+    formData.append('mad_multiplier_dfms', preset.madMultiplierDFMS.toString());
+    formData.append('cps_threshold_dfms', preset.cpsThresholdDFMS.toString());
+  };
+
+  // Cambiar de preset: si ya hay un espectro cargado, se refiltra en el backend
+  // sin volver a subir el archivo
+  const handlePresetChange = async (level) => {
+    setFilterPreset(level);
+    if (!spectrumId) return;
+
+    const formData = new FormData();
+    formData.append('spectrum_id', spectrumId);
+    appendPresetParams(formData, level);
+
+    try {
+      const { data } = await axios.post(`${API_URL}/refilter`, formData, {
+        headers: {
+          'Content-Type': 'multipart/form-data',
+        },
+      });
+      setSpectrum(data.spectrum);
+      setError('');
+    } catch (err) {
+      if (err.response?.status === 404) {
+        // El backend ya no tiene el espectro: hay que volver a subir el archivo
+        setSpectrumId(null);
+      }
+      const errorMessage = err.response?.data?.error || err.message || 'Error desconocido';
+      setError(`Error al refiltrar el espectro: ${errorMessage}`);
+      console.error('Error:', err);
+    }
+  };
+
   const handleFileChange = async (e) => {
     const file = e.target.files[0];
     if (!file) return;
 
-    if (!file.name.endsWith('.tab')) {
-      setError('Por favor, selecciona un archivo .tab');
+    if (!TAB_EXTENSIONS.some((ext) => file.name.toLowerCase().endsWith(ext))) {
+      setError('Por favor, selecciona un archivo .tab (o .tab.gz, .tab.bz2, .tab.zst, .zip)');
       return;
     }
 
     setLoading(true);
     setError('');
     setSpectrum(null);
+    setSpectrumId(null);
     setConclusion('');
 
     const formData = new FormData();
     formData.append('file', file);
-    formData.append('filter_level', 'high'); // Siempre alto grado
-    
-    // Enviar parámetros del preset seleccionado
-    const preset = filterPresets[filterPreset];
-    formData.append('head_drop', preset.headDrop.toString());
-    formData.append('mad_multiplier_rtof', preset.madMultiplierRTOF.toString());
-    formData.append('cps_threshold_rtof', preset.cpsThresholdRTOF.toString());
-    formData.append('mad_multiplier_dfms', preset.madMultiplierDFMS.toString());
-    formData.append('cps_threshold_dfms', preset.cpsThresholdDFMS.toString());
+    appendPresetParams(formData, filterPreset);
 
     try {
       const { data } = await axios.post(`${API_URL}/process`, formData, {
@@ -104,6 +144,7 @@ function UploadForm() {
       });
 
       setSpectrum(data.spectrum);
+      setSpectrumId(data.spectrum_id || null);
       
       // Asegurarse de que conclusion sea siempre un string
       let conclusionText = '';
@@ -258,7 +299,7 @@ function UploadForm() {
               <button
                 key={level}
                 type="button"
-                onClick={() => setFilterPreset(level)}
+                onClick={() => handlePresetChange(level)}
                 disabled={loading}
                 style={{
                   flex: '1',
@@ -350,7 +391,7 @@ function UploadForm() {
         <input
           id="file-input"
           type="file"
-          accept=".tab"
+          accept={TAB_EXTENSIONS.join(',')}
           onChange={handleFileChange}
           style={{ display: 'none' }}
           disabled={loading}